@@ -8,11 +8,87 @@
 # - Peer efficiency
 # - Time to complete
 
-import subprocess
-import time
+import contextlib
 import json
+import multiprocessing
+import os
+import tempfile
+import time
 from pathlib import Path
 
+from download import download_file
+from download_optimized import OptimizedDownloader
+
+RUN_TIMEOUT = 120  # Seconds allowed for each download
+
+
+class BenchmarkTimeout(BaseException):
+    # BaseException so the downloaders' own "except Exception" handlers
+    # can never swallow it
+    pass
+
+
+def _run_child(conn, log_path, func, args):
+    """Child side of run_captured: time func(*args) and send back the result."""
+    error = None
+    # Line-buffered, so whatever was printed survives the child being killed
+    with open(log_path, 'w', buffering=1) as log:
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(log):
+                func(*args)
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - start
+    conn.send((elapsed, error))
+    conn.close()
+
+
+def run_captured(func, *args):
+    """
+    Call func(*args) in a child process with its prints captured.
+
+    Returns (elapsed_seconds, output). This is deliberately not in-process:
+    the downloaders run worker threads that can't be interrupted, so a run
+    over RUN_TIMEOUT seconds is stopped by killing the child (and every
+    thread it started) before BenchmarkTimeout is raised. The timing is
+    taken inside the child, so process startup is not counted. The output
+    is printed either way, including the partial output of a timed-out run.
+
+    To profile a downloader, run download.py / download_optimized.py
+    directly under cProfile rather than through the benchmark.
+    """
+    fd, log_path = tempfile.mkstemp(prefix='benchmark-', suffix='.log')
+    os.close(fd)
+    recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=_run_child,
+                                   args=(send_conn, log_path, func, args), daemon=True)
+    proc.start()
+    send_conn.close()
+
+    try:
+        if not recv_conn.poll(RUN_TIMEOUT):
+            raise BenchmarkTimeout()
+        elapsed, error = recv_conn.recv()
+    except EOFError:
+        raise RuntimeError(f"downloader exited with code {proc.exitcode}")
+    finally:
+        if proc.is_alive():
+            proc.terminate()
+        proc.join()
+        recv_conn.close()
+        output = Path(log_path).read_text(errors='replace')
+        os.unlink(log_path)
+        print(output)
+
+    if error:
+        raise RuntimeError(error)
+    return elapsed, output
+
+
+def run_optimized(torrent_file: str, output_file: str, max_pieces: int):
+    OptimizedDownloader(torrent_file, output_file, max_pieces).run()
+
 
 def run_benchmark(torrent_file: str, max_pieces: int = 10):
     """
@@ -34,20 +110,11 @@ def run_benchmark(torrent_file: str, max_pieces: int = 10):
     print("\n[Test 1] Running NAIVE implementation...")
     print("-" * 60)
 
-    naive_start = time.time()
     try:
-        # Run naive downloader
-        result = subprocess.run(
-            ['python3', 'download.py', torrent_file, 'test_naive.bin', str(max_pieces)],
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
-        naive_time = time.time() - naive_start
-
-        # Parse output for statistics
-        output = result.stdout
-        print(output)
+        # Run naive downloader in a child process (timed from inside it,
+        # so interpreter startup isn't counted)
+        naive_time, output = run_captured(download_file, torrent_file,
+                                          'test_naive.bin', max_pieces)
 
         # Extract file size
         if Path('test_naive.bin').exists():
@@ -65,7 +132,7 @@ def run_benchmark(torrent_file: str, max_pieces: int = 10):
             results['naive']['success'] = False
             print("\n✗ Naive download failed")
 
-    except subprocess.TimeoutExpired:
+    except BenchmarkTimeout:
         print("\n✗ Naive download timed out")
         results['naive']['success'] = False
     except Exception as e:
@@ -78,19 +145,10 @@ def run_benchmark(torrent_file: str, max_pieces: int = 10):
     print("\n\n[Test 2] Running OPTIMIZED implementation...")
     print("-" * 60)
 
-    opt_start = time.time()
     try:
-        # Run optimized downloader
-        result = subprocess.run(
-            ['python3', 'download_optimized.py', torrent_file, 'test_optimized.bin', str(max_pieces)],
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
-        opt_time = time.time() - opt_start
-
-        output = result.stdout
-        print(output)
+        # Run optimized downloader, also in a child process
+        opt_time, output = run_captured(run_optimized, torrent_file,
+                                        'test_optimized.bin', max_pieces)
 
         # Parse output for optimization stats
         if Path('test_optimized.bin').exists():
@@ -124,7 +182,7 @@ def run_benchmark(torrent_file: str, max_pieces: int = 10):
             results['optimized']['success'] = False
             print("\n✗ Optimized download failed")
 
-    except subprocess.TimeoutExpired:
+    except BenchmarkTimeout:
         print("\n✗ Optimized download timed out")
         results['optimized']['success'] = False
     except Exception as e:
@@ -12,6 +12,28 @@
 #     from bencode import decode, encode
 #     obj = decode(b"4:spam")
 #     bencode = encode(obj)
+#
+# If the C extension from `better-bencode` is installed, decode()/encode()
+# delegate to it. Otherwise decode() uses the Cython build of
+# bencode_c.pyx if present (`cythonize -i bencode_c.pyx`); the
+# pure-Python implementation below is the fallback.
+
+try:
+    from better_bencode import _fast as _bb
+    _HAVE_BB = True
+except ImportError:
+    _bb = None
+    _HAVE_BB = False
+
+try:
+    import bencode_c as _bc
+    _HAVE_BC = True
+except ImportError:
+    _bc = None
+    _HAVE_BC = False
+
+HAVE_C_DECODER = _HAVE_BB or _HAVE_BC  # decode() runs in C rather than Python
+
 
 class BencodeError(Exception):
     """Generic bencode parsing error."""
@@ -22,8 +44,10 @@ class BencodeDecoder:
     def __init__(self, data: bytes):
         if not isinstance(data, (bytes, bytearray)):
             raise TypeError("BencodeDecoder expects bytes or bytearray")
-        self.data = data
+        self.data = bytes(data)
+        self._mv = memoryview(self.data)  # zero-copy view for bytestring payloads
         self.i = 0  # current cursor position
+        self.info_slice = None  # (start, end) of the top-level b"info" value
 
     def decode(self):
         """Decode entire input, ensure no extra trailing data."""
@@ -37,26 +61,74 @@ class BencodeDecoder:
     # ---------- core dispatch ----------
 
     def _parse_value(self):
-        if self.i >= len(self.data):
-            raise BencodeError("Unexpected end of data while parsing value")
-
-        c = self.data[self.i:self.i+1]  # single-byte slice
-        if c == b"i":
-            return self._parse_int()
-        elif c == b"l":
-            return self._parse_list()
-        elif c == b"d":
-            return self._parse_dict()
-        elif b"0" <= c <= b"9":
-            return self._parse_bytestring()
-        else:
-            raise BencodeError(f"Invalid bencode prefix byte {c!r} at position {self.i}")
+        """
+        Parse one value iteratively.
+
+        Lists and dicts being filled are kept on an explicit stack of
+        [container, pending_key, value_start] frames instead of recursing,
+        so deeply nested input can't hit the interpreter's recursion limit.
+
+        The byte range of the top-level dict's b"info" value is recorded in
+        self.info_slice so the info hash can be taken over the original bytes.
+        """
+        data = self.data
+        n = len(data)
+        stack = []
+
+        while True:
+            if self.i >= n:
+                if stack:
+                    kind = "list" if isinstance(stack[-1][0], list) else "dict"
+                    raise BencodeError(f"Unexpected end of data inside {kind}")
+                raise BencodeError("Unexpected end of data while parsing value")
+
+            c = data[self.i]  # int, no 1-byte slice
+
+            if c == 0x65 and stack:  # 'e' closes the innermost container
+                container, key, _ = stack.pop()
+                if key is not None:
+                    raise BencodeError(f"Missing value for dict key {key!r}")
+                self.i += 1
+                value = container
+            elif stack and isinstance(stack[-1][0], dict) and stack[-1][1] is None:
+                # keys must be byte strings per spec
+                if not 0x30 <= c <= 0x39:
+                    raise BencodeError(f"Dict key must be a bytestring, got prefix {chr(c)!r} at position {self.i}")
+                stack[-1][1] = self._parse_bytestring()
+                stack[-1][2] = self.i
+                continue
+            elif c == 0x69:  # 'i'
+                value = self._parse_int()
+            elif c == 0x6C:  # 'l'
+                self.i += 1
+                stack.append([[], None, 0])
+                continue
+            elif c == 0x64:  # 'd'
+                self.i += 1
+                stack.append([{}, None, 0])
+                continue
+            elif 0x30 <= c <= 0x39:  # '0'..'9'
+                value = self._parse_bytestring()
+            else:
+                raise BencodeError(f"Invalid bencode prefix byte {bytes([c])!r} at position {self.i}")
+
+            # attach the finished value to its parent (or return it)
+            if not stack:
+                return value
+            frame = stack[-1]
+            if isinstance(frame[0], list):
+                frame[0].append(value)
+            else:
+                if frame[1] == b"info" and len(stack) == 1:
+                    self.info_slice = (frame[2], self.i)
+                frame[0][frame[1]] = value
+                frame[1] = None
 
     # ---------- integer: i<digits>e ----------
 
     def _parse_int(self):
         # expect 'i'
-        if self.data[self.i:self.i+1] != b"i":
+        if self.data[self.i] != 0x69:
             raise BencodeError(f"Expected 'i' at start of int, got {self.data[self.i:self.i+1]!r}")
         self.i += 1  # skip 'i'
 
@@ -72,9 +144,9 @@ class BencodeDecoder:
         # validation: no leading zeros except "0", and "-0" is invalid
         if int_bytes == b"-0":
             raise BencodeError("Invalid integer '-0'")
-        if int_bytes[0:1] == b"0" and len(int_bytes) > 1:
+        if int_bytes[0] == 0x30 and len(int_bytes) > 1:
             raise BencodeError(f"Leading zeros not allowed in integer: {int_bytes!r}")
-        if int_bytes[0:1] == b"-" and (len(int_bytes) == 1 or int_bytes[1:2] == b"0"):
+        if int_bytes[0] == 0x2D and (len(int_bytes) == 1 or int_bytes[1] == 0x30):
             # "-0", "-01", etc.
             raise BencodeError(f"Invalid negative integer: {int_bytes!r}")
 
@@ -98,67 +170,39 @@ class BencodeDecoder:
         if not len_bytes:
             raise BencodeError("Empty length for bytestring")
 
-        # length must be all digits (remember: iterating bytes -> ints in Py3)
-        if not all(ord("0") <= ch <= ord("9") for ch in len_bytes):
+        # length must be all ASCII digits; bytes.isdigit() checks that in C
+        # (int() alone would accept signs, spaces and underscores)
+        if not len_bytes.isdigit():
             raise BencodeError(f"Non-digit in bytestring length: {len_bytes!r}")
 
         # leading zeros only allowed if length is "0"
-        if len_bytes[0:1] == b"0" and len(len_bytes) > 1:
+        if len_bytes[0] == 0x30 and len(len_bytes) > 1:
             raise BencodeError(f"Leading zeros not allowed in bytestring length: {len_bytes!r}")
 
-        length = int(len_bytes.decode("ascii"))
+        length = int(len_bytes)
 
         start = colon + 1
         end = start + length
         if end > len(self.data):
             raise BencodeError("Bytestring length exceeds available data")
 
-        value = self.data[start:end]
+        value = bytes(self._mv[start:end])
         self.i = end
         return value
 
-    # ---------- list: l<value>...e ----------
-
-    def _parse_list(self):
-        if self.data[self.i:self.i+1] != b"l":
-            raise BencodeError("Expected 'l' at start of list")
-        self.i += 1  # skip 'l'
-
-        result = []
-        while True:
-            if self.i >= len(self.data):
-                raise BencodeError("Unexpected end of data inside list")
-            if self.data[self.i:self.i+1] == b"e":
-                self.i += 1  # skip 'e'
-                break
-            result.append(self._parse_value())
-        return result
-
-    # ---------- dict: d<key><value>...e ----------
-
-    def _parse_dict(self):
-        if self.data[self.i:self.i+1] != b"d":
-            raise BencodeError("Expected 'd' at start of dict")
-        self.i += 1  # skip 'd'
-
-        result = {}
-        while True:
-            if self.i >= len(self.data):
-                raise BencodeError("Unexpected end of data inside dict")
-            if self.data[self.i:self.i+1] == b"e":
-                self.i += 1  # skip 'e'
-                break
-
-            # keys must be byte strings per spec
-            key = self._parse_bytestring()
-            value = self._parse_value()
-            result[key] = value
-
-        return result
-
 
 def decode(data: bytes):
     """Convenience top-level API: decode bencoded bytes into Python objects."""
+    if _HAVE_BB:
+        try:
+            return _bb.loads(bytes(data))
+        except ValueError as e:
+            raise BencodeError(str(e)) from e
+    if _HAVE_BC:
+        try:
+            return _bc.decode(data)
+        except ValueError as e:
+            raise BencodeError(str(e)) from e
     return BencodeDecoder(data).decode()
 
 def encode(obj) -> bytes:
@@ -167,31 +211,80 @@ def encode(obj) -> bytes:
 
     Supports: int, bytes, list, dict
     """
+    if _HAVE_BB:
+        return _bb.dumps(obj)
+    return _encode_python(obj)
+
+
+def encoded_length(obj) -> int:
+    """
+    Length in bytes of encode(obj), computed without building it.
+
+    Walks the structure with an explicit stack, like BencodeDecoder, so
+    deeply nested input from a C decoder can't hit the recursion limit.
+    """
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, int):
+            total += len(str(obj)) + 2
+        elif isinstance(obj, bytes):
+            total += len(str(len(obj))) + 1 + len(obj)
+        elif isinstance(obj, list):
+            total += 2
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            total += 2
+            for key, value in obj.items():
+                stack.append(key)
+                stack.append(value)
+        else:
+            raise TypeError(f"Cannot bencode object of type {type(obj)}")
+    return total
+
+
+def _encode_python(obj) -> bytes:
+    """Pure-Python encoder used when better-bencode isn't available."""
+    parts = []
+    _encode_into(obj, parts)
+    return b"".join(parts)
+
+
+def _encode_into(obj, out: list):
+    """
+    Append the bencoded fragments of obj to out.
+
+    Fragments are joined once by encode(), so nested containers don't
+    re-copy their children on every level (O(n) instead of O(n^2)).
+    """
     if isinstance(obj, int):
         # Integer: i<number>e
-        return b"i" + str(obj).encode('ascii') + b"e"
+        out.append(b"i")
+        out.append(str(obj).encode('ascii'))
+        out.append(b"e")
 
     elif isinstance(obj, bytes):
         # Bytestring: <length>:<data>
-        return str(len(obj)).encode('ascii') + b":" + obj
+        out.append(f"{len(obj)}".encode('ascii'))
+        out.append(b":")
+        out.append(obj)
 
     elif isinstance(obj, list):
         # List: l<items>e
-        result = b"l"
+        out.append(b"l")
         for item in obj:
-            result += encode(item)
-        result += b"e"
-        return result
+            _encode_into(item, out)
+        out.append(b"e")
 
     elif isinstance(obj, dict):
         # Dictionary: d<key><value>...e
         # IMPORTANT: keys must be sorted!
-        result = b"d"
-        for key in sorted(obj.keys()):
-            result += encode(key)
-            result += encode(obj[key])
-        result += b"e"
-        return result
+        out.append(b"d")
+        for key, value in sorted(obj.items()):
+            _encode_into(key, out)
+            _encode_into(value, out)
+        out.append(b"e")
 
     else:
         raise TypeError(f"Cannot bencode object of type {type(obj)}")
@@ -0,0 +1,161 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+#
+# bencode_c.pyx
+#
+# Cython version of the bencode decoder in bencode.py.
+# - Walks a const unsigned char* instead of indexing a Python bytes object
+# - Same output types and validation rules as bencode.BencodeDecoder
+# - Raises ValueError on malformed input (bencode.decode() turns that
+#   into BencodeError)
+#
+# Build in place (needs Cython and a C compiler):
+#     cythonize -i bencode_c.pyx
+#
+# bencode.decode() picks this module up automatically once it is built;
+# bencode.py stays the reference implementation and the fallback.
+
+from cpython.bytes cimport PyBytes_FromStringAndSize
+
+cdef enum:
+    MAX_DEPTH = 1000  # Nesting limit, keeps recursion off the end of the C stack
+
+
+cdef class BencodeDecoder:
+    cdef bytes data  # keeps buf alive
+    cdef const unsigned char* buf
+    cdef Py_ssize_t i, n
+
+    def __init__(self, data):
+        if not isinstance(data, (bytes, bytearray)):
+            raise TypeError("BencodeDecoder expects bytes or bytearray")
+        self.data = bytes(data)
+        self.buf = self.data
+        self.n = len(self.data)
+        self.i = 0
+
+    def decode(self):
+        """Decode entire input, ensure no extra trailing data."""
+        value = self._parse_value(0)
+        if self.i != self.n:
+            raise ValueError(f"Extra data after valid bencode: {self.n - self.i} bytes")
+        return value
+
+    # ---------- core dispatch ----------
+
+    cdef object _parse_value(self, int depth):
+        cdef unsigned char c
+        cdef list items
+        cdef dict d
+        if depth > MAX_DEPTH:
+            raise ValueError("Bencode nested too deeply")
+        if self.i >= self.n:
+            raise ValueError("Unexpected end of data while parsing value")
+
+        c = self.buf[self.i]
+        if c == b'i':
+            return self._parse_int()
+        if b'0' <= c <= b'9':
+            return self._parse_bytestring()
+        if c == b'l':
+            self.i += 1
+            items = []
+            while True:
+                if self.i >= self.n:
+                    raise ValueError("Unexpected end of data inside list")
+                if self.buf[self.i] == b'e':
+                    self.i += 1
+                    return items
+                items.append(self._parse_value(depth + 1))
+        if c == b'd':
+            self.i += 1
+            d = {}
+            while True:
+                if self.i >= self.n:
+                    raise ValueError("Unexpected end of data inside dict")
+                c = self.buf[self.i]
+                if c == b'e':
+                    self.i += 1
+                    return d
+                # keys must be byte strings per spec
+                if not b'0' <= c <= b'9':
+                    raise ValueError(f"Dict key must be a bytestring, got prefix {chr(c)!r} at position {self.i}")
+                key = self._parse_bytestring()
+                d[key] = self._parse_value(depth + 1)
+        raise ValueError(f"Invalid bencode prefix byte {bytes([c])!r} at position {self.i}")
+
+    # ---------- integer: i<digits>e ----------
+
+    cdef object _parse_int(self):
+        cdef Py_ssize_t start
+        cdef long long v = 0
+        cdef bint negative = False
+
+        self.i += 1  # skip 'i'
+        start = self.i
+        if self.i < self.n and self.buf[self.i] == b'-':
+            negative = True
+            self.i += 1
+        if self.i >= self.n or self.buf[self.i] == b'e':
+            raise ValueError("Empty integer")
+
+        # leading zeros only allowed for "0"; "-0" is invalid
+        if self.buf[self.i] == b'0':
+            if negative:
+                raise ValueError("Invalid negative integer")
+            if self.i + 1 < self.n and self.buf[self.i + 1] != b'e':
+                raise ValueError("Leading zeros not allowed in integer")
+
+        while self.i < self.n and self.buf[self.i] != b'e':
+            if not b'0' <= self.buf[self.i] <= b'9':
+                raise ValueError(f"Invalid integer digits at position {self.i}")
+            if self.i - start >= 18:
+                # Too many digits for a long long; let Python do it
+                return self._parse_big_int(start)
+            v = v * 10 + (self.buf[self.i] - c'0')
+            self.i += 1
+        if self.i >= self.n:
+            raise ValueError("Missing 'e' terminator for integer")
+
+        self.i += 1  # move past 'e'
+        return -v if negative else v
+
+    cdef object _parse_big_int(self, Py_ssize_t start):
+        cdef Py_ssize_t end = start
+        while end < self.n and self.buf[end] != b'e':
+            if not (b'0' <= self.buf[end] <= b'9' or (end == start and self.buf[end] == b'-')):
+                raise ValueError(f"Invalid integer digits at position {end}")
+            end += 1
+        if end >= self.n:
+            raise ValueError("Missing 'e' terminator for integer")
+        self.i = end + 1
+        return int(self.data[start:end])
+
+    # ---------- bytestring: <len>:<data> ----------
+
+    cdef bytes _parse_bytestring(self):
+        cdef Py_ssize_t start = self.i
+        cdef Py_ssize_t length = 0
+
+        while self.i < self.n and self.buf[self.i] != b':':
+            if not b'0' <= self.buf[self.i] <= b'9':
+                raise ValueError(f"Non-digit in bytestring length at position {self.i}")
+            length = length * 10 + (self.buf[self.i] - c'0')
+            if length > self.n:
+                raise ValueError("Bytestring length exceeds available data")
+            self.i += 1
+        if self.i >= self.n:
+            raise ValueError("Missing ':' in bytestring length")
+        if self.buf[start] == b'0' and self.i - start > 1:
+            raise ValueError("Leading zeros not allowed in bytestring length")
+
+        self.i += 1  # skip ':'
+        if length > self.n - self.i:
+            raise ValueError("Bytestring length exceeds available data")
+        start = self.i
+        self.i += length
+        return PyBytes_FromStringAndSize(<const char*>self.buf + start, length)
+
+
+def decode(data):
+    """Decode bencoded bytes into Python objects."""
+    return BencodeDecoder(data).decode()
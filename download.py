@@ -4,54 +4,202 @@
 #
 # Strategy:
 # 1. Get peers from tracker
-# 2. Connect to peer and handshake
+# 2. Connect to all peers at once and handshake (one persistent session per peer)
 # 3. Exchange protocol messages
-# 4. Download pieces in 16KB blocks
+# 4. Download pieces (rarest first) in 16KB blocks, in parallel across peers
 # 5. Verify piece hashes
-# 6. Write to file
+# 6. Write each piece in place into a memory-mapped output file
 
+import asyncio
 import socket
+import struct
 import hashlib
+import mmap
 import time
 import os
+import queue
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from peer_protocol import *
 from tracker_http import *
-from torrent_meta import load_torrent
-from file_manager import FileManager
+from torrent_meta import load_torrent_with_info_hash
+from file_manager import FileManager, preallocate
+from peer_manager import PeerManager
 
 
 BLOCK_SIZE = 16384  # 16 KB - standard block size
+PIPELINE_DEPTH = 10  # Block requests kept outstanding per peer
+RECV_BUFFER_SIZE = 65536  # Per-peer receive buffer (grows only for oversized messages)
+MAX_PEER_CONNECTIONS = 20  # Worker threads, i.e. peer connections open at once
+RECHOKE_INTERVAL = 10  # Seconds between tit-for-tat rechoke rounds
+UNCHOKED_PEERS = 4  # 3 best uploaders to us + 1 optimistic unchoke
+MAX_RECONNECTS = 2  # Times a peer that dropped mid-download is retried
+SOCKET_RCVBUF = 2 * 1024 * 1024  # Kernel receive buffer (room for a big TCP window)
+SOCKET_SNDBUF = 512 * 1024  # Kernel send buffer
+CONNECT_TIMEOUT = 5  # Seconds a racing connection attempt gets to handshake
 DOWNLOADS_DIR = "downloads"  # Directory for downloaded files
 
 
-def download_piece(peer_ip: str, peer_port: int, info_hash: bytes,
-                   peer_id: bytes, piece_index: int, piece_length: int,
-                   timeout: int = 30) -> bytes:
+def create_peer_socket() -> socket.socket:
+    """TCP socket with the options used for every peer connection."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Send request batches immediately (no Nagle delay), and size the
+    # buffers before connect() so the window scale is negotiated for them
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SNDBUF)
+    return sock
+
+
+async def try_peer(peer: dict, info_hash: bytes, peer_id: bytes) -> tuple:
+    """
+    Connect to one peer and exchange handshakes; returns (peer, sock).
+
+    Interested is sent along with our handshake.
+    """
+    loop = asyncio.get_running_loop()
+    sock = create_peer_socket()
+    sock.setblocking(False)
+    try:
+        await loop.sock_connect(sock, (peer['ip'], peer['port']))
+        await loop.sock_sendall(sock, create_handshake(info_hash, peer_id)
+                                + create_message(MSG_INTERESTED))
+
+        response = b""
+        while len(response) < 68:
+            data = await loop.sock_recv(sock, 68 - len(response))
+            if not data:
+                raise Exception(f"Connection closed during handshake (got {len(response)} bytes)")
+            response += data
+        parse_handshake(response)
+    except BaseException:
+        sock.close()
+        raise
+    return peer, sock
+
+
+async def race_connect(peers: list, info_hash: bytes, peer_id: bytes,
+                       on_connected, timeout: float = CONNECT_TIMEOUT) -> int:
+    """
+    Connect to all peers concurrently.
+
+    Each peer that completes the handshake is passed to
+    on_connected(peer, sock) as soon as it does, so downloading can start
+    after one round trip instead of waiting on dead peers one at a time.
+    Attempts still unfinished after timeout seconds are abandoned.
+
+    Returns the number of peers connected.
     """
-    Download a single piece from a peer.
+    async def attempt(peer: dict) -> tuple:
+        # Returns (peer, sock, None) or (peer, None, error), so a failure
+        # can still be reported against its peer
+        try:
+            return (*await asyncio.wait_for(try_peer(peer, info_hash, peer_id), timeout), None)
+        except (Exception, asyncio.TimeoutError) as e:
+            return peer, None, e
+
+    tasks = [asyncio.create_task(attempt(peer)) for peer in peers]
+    connected = 0
+    for next_done in asyncio.as_completed(tasks):
+        peer, sock, error = await next_done
+        if error is not None:
+            print(f"  Could not connect to {peer['ip']}:{peer['port']}: "
+                  f"{str(error) or type(error).__name__}")
+            continue
+        print(f"  Handshake OK with {peer['ip']}:{peer['port']}")
+        on_connected(peer, sock)
+        connected += 1
+    return connected
+
+
+class PeerSession:
+    """
+    A persistent connection to one peer, reused for many pieces.
 
-    Steps:
+    Connecting does:
     1. TCP connect
     2. Send/receive handshake
     3. Wait for bitfield
     4. Send interested
     5. Wait for unchoke
-    6. Request blocks
-    7. Receive piece data
 
-    Returns: piece data as bytes
+    After that, download_piece() only has to request blocks.
+
+    Pieces the peer announces (bitfield and HAVE messages) are collected
+    in self.have; on_have, if given, is called for each later HAVE.
+    If a PeerManager is given, received blocks and the peer's choke and
+    interest state are reported to it. If sock is given it must already be
+    connected and past the handshake (see race_connect).
     """
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(timeout)
 
-    try:
-        print(f"  Connecting to {peer_ip}:{peer_port}...")
-        sock.connect((peer_ip, peer_port))
+    def __init__(self, peer_ip: str, peer_port: int, info_hash: bytes,
+                 peer_id: bytes, timeout: int = 30, on_have=None,
+                 peer_manager: PeerManager = None, sock: socket.socket = None):
+        self.ip = peer_ip
+        self.port = peer_port
+        self.unchoked = False
+        self.choked_by_us = True  # Connections start out choked both ways
+        self.bitfield_received = False
+        self.have = set()
+        self.on_have = on_have
+        self.peer_manager = peer_manager
+        self.stats = peer_manager.add_peer(peer_ip, peer_port) if peer_manager else None
+        self.send_lock = threading.Lock()  # The choker sends from its own thread
+
+        # Fixed receive buffer filled with recv_into(): buf[head:tail] holds
+        # received bytes that haven't been parsed yet
+        self.buf = bytearray(RECV_BUFFER_SIZE)
+        self.head = 0
+        self.tail = 0
+
+        # State of the piece currently being downloaded (see download_piece)
+        self.piece_index = None
+        self.piece_data = None
+        self.pending = {}  # offset -> block size, requested but not yet received
+        self.to_request = deque()
+        self.received = 0
+
+        self.sock = sock if sock is not None else create_peer_socket()
+        self.sock.settimeout(timeout)
+
+        try:
+            if sock is None:
+                print(f"  Connecting to {peer_ip}:{peer_port}...")
+                self.sock.connect((peer_ip, peer_port))
+                self._handshake(info_hash, peer_id)
+            self._await_unchoke()
+        except BaseException:
+            self.sock.close()
+            raise
 
-        # Send handshake
-        handshake = create_handshake(info_hash, peer_id)
-        sock.sendall(handshake)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def send(self, data: bytes):
+        with self.send_lock:
+            self.sock.sendall(data)
+
+    def set_choked(self, choked: bool):
+        """Choke or unchoke the peer, sending a message only on change."""
+        if choked != self.choked_by_us:
+            self.send(create_message(MSG_CHOKE if choked else MSG_UNCHOKE))
+            self.choked_by_us = choked
+
+    def _handshake(self, info_hash: bytes, peer_id: bytes):
+        sock = self.sock
+
+        # Send handshake and interested in one write (peers only unchoke
+        # interested downloaders, so there's no reason to wait before it)
+        sock.sendall(create_handshake(info_hash, peer_id) + create_message(MSG_INTERESTED))
 
         # Receive handshake response (may need multiple recv calls)
         response = b""
@@ -64,129 +212,303 @@ def download_piece(peer_ip: str, peer_port: int, info_hash: bytes,
         peer_info = parse_handshake(response)
         print(f"  Handshake OK with peer {peer_info['peer_id'][:8].hex()}")
 
-        # Read messages
-        buffer = b""
-        bitfield_received = False
-        unchoked = False
-
-        # Wait for bitfield (or unchoke if peer doesn't send bitfield)
-        print("  Waiting for bitfield...")
-        timeout_counter = 0
-        while not bitfield_received and timeout_counter < 5:
-            try:
-                data = sock.recv(4096)
-                if not data:
-                    raise Exception("Connection closed before bitfield")
-                buffer += data
-
-                # Try to parse all messages in buffer
-                while True:
-                    msg_id, payload, consumed = parse_message(buffer)
-                    if consumed == 0:
-                        break  # Need more data
-
-                    buffer = buffer[consumed:]
-
-                    if msg_id == MSG_BITFIELD:
-                        print("  Received bitfield")
-                        bitfield_received = True
-                        break
-                    elif msg_id == MSG_UNCHOKE:
-                        print("  Received unchoke (no bitfield sent)")
-                        bitfield_received = True  # Skip bitfield
-                        unchoked = True
-                        break
-                    elif msg_id is not None:
-                        print(f"  Received message ID: {msg_id}")
-
-                if bitfield_received:
-                    break
-
-            except socket.timeout:
-                timeout_counter += 1
-                print(f"  Timeout {timeout_counter}/5...")
+    def _await_unchoke(self):
+        # Interested went out with the handshake; the bitfield (if any)
+        # is handled on the way
+        if self.stats:
+            self.stats.we_are_interested = True
+        print("  Waiting for unchoke...")
+        while not self.unchoked:
+            self._fill_buffer()
+            self._process_messages()
+        print("  Received unchoke - ready to download!")
+
+    # ---------- receive path ----------
+
+    def _fill_buffer(self):
+        """Read more data from the socket straight into the receive buffer."""
+        buf = self.buf
+        if self.head == self.tail:
+            self.head = self.tail = 0
+        elif self.head > len(buf) // 2 or self.tail == len(buf):
+            # Move the unparsed bytes to the front (same-size slice
+            # assignment, so the buffer is never reallocated here)
+            unparsed = self.tail - self.head
+            buf[:unparsed] = buf[self.head:self.tail]
+            self.head, self.tail = 0, unparsed
+
+        if self.tail == len(buf):
+            # A single message larger than the buffer (e.g. a huge bitfield)
+            buf.extend(bytes(len(buf)))
+
+        with memoryview(buf) as view:
+            n = self.sock.recv_into(view[self.tail:])
+        if n == 0:
+            raise Exception("Connection closed by peer")
+        self.tail += n
+
+    def _process_messages(self):
+        """Handle every complete message in the receive buffer."""
+        # Payloads are memoryviews into self.buf; handlers copy what they
+        # keep, so no view outlives this call and the buffer can be reused.
+        while True:
+            # Blocks are nearly all of the traffic; decode them in one step
+            piece = parse_piece_at(self.buf, self.head, self.tail)
+            if piece is not None:
+                index, begin, block, consumed = piece
+                self.head += consumed
+                self._handle_block(index, begin, block)
                 continue
 
-        # Send interested (if not already unchoked)
-        if not unchoked:
-            sock.sendall(create_message(MSG_INTERESTED))
-            print("  Sent interested")
-
-            # Wait for unchoke
-            print("  Waiting for unchoke...")
-            while not unchoked:
-                data = sock.recv(4096)
-                if not data:
-                    raise Exception("Connection closed before unchoke")
-                buffer += data
-
-                while True:
-                    msg_id, payload, consumed = parse_message(buffer)
-                    if consumed == 0:
-                        break
-
-                    buffer = buffer[consumed:]
-
-                    if msg_id == MSG_UNCHOKE:
-                        print("  Received unchoke - ready to download!")
-                        unchoked = True
-                        break
-                    elif msg_id is not None:
-                        print(f"  Received message ID: {msg_id}")
-
-                if unchoked:
-                    break
+            msg_id, payload, consumed = parse_message(self.buf, self.head, self.tail)
+            if consumed == 0:
+                break  # Need more data
+            self.head += consumed
+            if msg_id is not None:
+                self._handle_message(msg_id, payload)
+
+    def _handle_message(self, msg_id: int, payload):
+        if msg_id == MSG_PIECE:
+            piece_msg = parse_piece_message(payload)
+            self._handle_block(piece_msg['index'], piece_msg['begin'], piece_msg['block'])
+        elif msg_id == MSG_HAVE:
+            self._handle_have(payload)
+        elif msg_id == MSG_BITFIELD:
+            print("  Received bitfield")
+            self.have.update(parse_bitfield(payload))
+            self.bitfield_received = True
+        elif msg_id == MSG_UNCHOKE:
+            if not self.bitfield_received:
+                print("  Received unchoke (no bitfield sent)")
+            self.unchoked = True
+            if self.stats:
+                self.stats.is_choking_us = False
+        elif msg_id == MSG_CHOKE:
+            # Peer discards outstanding requests; re-send them after unchoke
+            print("  Choked by peer - waiting for unchoke")
+            self.unchoked = False
+            self.to_request.extendleft(sorted(self.pending, reverse=True))
+            self.pending.clear()
+            if self.stats:
+                self.stats.is_choking_us = True
+        elif msg_id in (MSG_INTERESTED, MSG_NOT_INTERESTED):
+            if self.stats:
+                self.stats.is_interested_in_us = msg_id == MSG_INTERESTED
         else:
-            print("  Already unchoked - ready to download!")
+            print(f"  Received message ID: {msg_id}")
+
+    def _handle_have(self, payload):
+        piece_index = struct.unpack(">I", payload)[0]
+        if piece_index not in self.have:
+            self.have.add(piece_index)
+            if self.on_have:
+                self.on_have(piece_index)
+
+    def _handle_block(self, index: int, begin: int, block):
+        # Verify it's a block we requested
+        if index != self.piece_index or self.pending.get(begin) != len(block):
+            print(f"  Warning: unexpected piece message (idx={index}, begin={begin})")
+            return
+
+        del self.pending[begin]
+        self.piece_data[begin:begin + len(block)] = block
+        self.received += len(block)
+        if self.peer_manager:
+            self.peer_manager.update_download(self.ip, self.port, len(block))
+        print(f"  Received block at offset {begin} ({len(block)} bytes)")
+
+    # ---------- download ----------
+
+    def _request_blocks(self, piece_length: int):
+        """Top up the request pipeline to PIPELINE_DEPTH outstanding blocks."""
+        if not self.unchoked or not self.to_request or len(self.pending) >= PIPELINE_DEPTH:
+            return
+
+        requests = []
+        while self.to_request and len(self.pending) < PIPELINE_DEPTH:
+            offset = self.to_request.popleft()
+            block_size = min(BLOCK_SIZE, piece_length - offset)
+            self.pending[offset] = block_size
+            requests.append(create_request(self.piece_index, offset, block_size))
+        self.send(b"".join(requests))
+        print(f"  Requested {len(requests)} block(s), {len(self.pending)} outstanding")
+
+    def download_piece(self, piece_index: int, piece_length: int) -> bytearray:
+        """
+        Download a single piece over this connection.
+
+        Keeps up to PIPELINE_DEPTH block requests outstanding so the
+        connection doesn't idle for a round trip per block.
+
+        Returns: piece data (the preallocated bytearray, not a copy)
+        """
+        self.piece_index = piece_index
+        self.piece_data = bytearray(piece_length)
+        self.to_request = deque(range(0, piece_length, BLOCK_SIZE))
+        self.pending = {}
+        self.received = 0
 
-        # Request and download blocks
-        piece_data = b""
-        offset = 0
+        try:
+            while self.received < piece_length:
+                self._request_blocks(piece_length)
+                self._fill_buffer()
+                self._process_messages()
 
-        while offset < piece_length:
-            block_size = min(BLOCK_SIZE, piece_length - offset)
+            print(f"  Piece {piece_index} downloaded completely ({piece_length} bytes)")
+            return self.piece_data
+        finally:
+            self.piece_index = None
+            self.piece_data = None
 
-            # Send request
-            request = create_request(piece_index, offset, block_size)
-            sock.sendall(request)
-            print(f"  Requested block at offset {offset} ({block_size} bytes)")
-
-            # Receive piece
-            received_block = False
-            while not received_block:
-                data = sock.recv(32768)  # Larger buffer for block data
-                if not data:
-                    raise Exception(f"Connection closed while downloading block at {offset}")
-                buffer += data
-
-                msg_id, payload, consumed = parse_message(buffer)
-                if consumed > 0:
-                    buffer = buffer[consumed:]
-
-                    if msg_id == MSG_PIECE:
-                        piece_msg = parse_piece_message(payload)
-
-                        # Verify it's the block we requested
-                        if piece_msg['index'] == piece_index and piece_msg['begin'] == offset:
-                            piece_data += piece_msg['block']
-                            print(f"  Received block at offset {offset} ({len(piece_msg['block'])} bytes)")
-                            received_block = True
-                        else:
-                            print(f"  Warning: unexpected piece message (idx={piece_msg['index']}, begin={piece_msg['begin']})")
 
-            offset += block_size
+class PiecePicker:
+    """
+    Rarest-first piece selection.
 
-        print(f"  Piece {piece_index} downloaded completely ({len(piece_data)} bytes)")
-        return piece_data
+    rarity[i] counts the connected peers that have piece i; it is updated
+    incrementally from each peer's bitfield and HAVE messages. The next
+    piece for a peer is a random one among the rarest pieces that peer has
+    and we still need. Until RANDOM_FIRST pieces are verified, pieces are
+    picked uniformly at random instead so we quickly have something to share.
+    """
 
-    finally:
-        sock.close()
+    RANDOM_FIRST = 4
+
+    def __init__(self, num_pieces: int):
+        self.num_pieces = num_pieces
+        self.rarity = [0] * num_pieces
+        self.have_sets = {}  # peer key -> set of piece indices
+        self.still_needed = set(range(num_pieces))
+        self.in_progress = set()
+        self.verified = 0
+        self.lock = threading.Lock()
+
+    def add_peer(self, peer_key, pieces):
+        with self.lock:
+            have = {i for i in pieces if 0 <= i < self.num_pieces}
+            self.have_sets[peer_key] = have
+            for i in have:
+                self.rarity[i] += 1
+
+    def add_have(self, peer_key, piece_index: int):
+        with self.lock:
+            have = self.have_sets.get(peer_key)
+            if have is None or piece_index in have or not 0 <= piece_index < self.num_pieces:
+                return
+            have.add(piece_index)
+            self.rarity[piece_index] += 1
+
+    def remove_peer(self, peer_key):
+        with self.lock:
+            for i in self.have_sets.pop(peer_key, ()):
+                self.rarity[i] -= 1
+
+    def pick(self, peer_key):
+        """Reserve and return the next piece to fetch from peer_key, or None."""
+        with self.lock:
+            available = (self.still_needed - self.in_progress) & self.have_sets.get(peer_key, set())
+            if not available:
+                return None
+
+            if self.verified < self.RANDOM_FIRST:
+                candidates = list(available)
+            else:
+                min_r = min(self.rarity[i] for i in available)
+                candidates = [i for i in available if self.rarity[i] == min_r]
+
+            piece_index = random.choice(candidates)
+            self.in_progress.add(piece_index)
+            return piece_index
+
+    def mark_done(self, piece_index: int):
+        with self.lock:
+            self.in_progress.discard(piece_index)
+            self.still_needed.discard(piece_index)
+            self.verified += 1
+
+    def release(self, piece_index: int):
+        """Give a reserved piece back so another peer can fetch it."""
+        with self.lock:
+            self.in_progress.discard(piece_index)
+
+    def has_needed(self, peer_key) -> bool:
+        """True if peer_key has a piece we still need (possibly in progress)."""
+        with self.lock:
+            return not self.still_needed.isdisjoint(self.have_sets.get(peer_key, ()))
+
+    def done(self) -> bool:
+        return not self.still_needed
+
+
+class Choker:
+    """
+    Tit-for-tat choking for the connected peers.
 
+    Every RECHOKE_INTERVAL seconds a background timer runs PeerManager's
+    rechoke (best uploaders to us, plus an optimistic unchoke every 30 s;
+    ranked by our upload to them once we are seeding) and sends CHOKE or
+    UNCHOKE to each peer whose state changed.
+    """
 
-def verify_piece(piece_data: bytes, expected_hash: bytes) -> bool:
-    """Verify piece SHA-1 hash matches expected."""
-    actual_hash = hashlib.sha1(piece_data).digest()
-    return actual_hash == expected_hash
+    def __init__(self, peer_manager: PeerManager, is_seeding):
+        self.peer_manager = peer_manager
+        self.is_seeding = is_seeding  # callable -> bool
+        self.sessions = {}  # (ip, port) -> PeerSession
+        self.lock = threading.Lock()
+        self.timer = None
+        self.stopped = False
+
+    def add(self, session: PeerSession):
+        with self.lock:
+            self.sessions[(session.ip, session.port)] = session
+
+    def remove(self, session: PeerSession):
+        with self.lock:
+            self.sessions.pop((session.ip, session.port), None)
+
+    def start(self):
+        self._schedule()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            if self.timer:
+                self.timer.cancel()
+
+    def _schedule(self):
+        with self.lock:
+            if self.stopped:
+                return
+            self.timer = threading.Timer(RECHOKE_INTERVAL, self.rechoke)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def rechoke(self):
+        try:
+            # Already paced by our own timer
+            self.peer_manager.recalculate_choking(seeding=self.is_seeding(), force=True)
+            with self.lock:
+                sessions = list(self.sessions.values())
+            for session in sessions:
+                try:
+                    session.set_choked(session.stats.is_choked_by_us)
+                except OSError:
+                    pass  # Connection is going away; its worker will clean up
+        finally:
+            self._schedule()
+
+
+def verify_piece(piece_data, expected_hash: bytes) -> bool:
+    """
+    Verify piece SHA-1 hash matches expected.
+
+    Accepts any buffer (bytes, bytearray, memoryview) without copying;
+    hashlib releases the GIL while hashing, so worker threads verify
+    pieces concurrently.
+    """
+    h = hashlib.sha1()
+    h.update(memoryview(piece_data))
+    return h.digest() == expected_hash
 
 
 def download_file(torrent_path: str, output_path: str = None, max_pieces: int = None):
@@ -202,11 +524,10 @@ def download_file(torrent_path: str, output_path: str = None, max_pieces: int =
 
     # Load torrent metadata
     print("Loading torrent file...")
-    meta = load_torrent(torrent_path)
+    meta, info_hash = load_torrent_with_info_hash(torrent_path)
     info = meta[b'info']
 
     # Extract metadata
-    info_hash = calculate_info_hash(info)
     peer_id = generate_peer_id()
 
     # Use FileManager to handle both single and multi-file torrents
@@ -227,15 +548,28 @@ def download_file(torrent_path: str, output_path: str = None, max_pieces: int =
     if file_info['is_multi_file']:
         file_manager.print_file_list()
 
-    print(f"\nWill save to: {file_manager.get_output_summary()}")
+    # Pieces are written straight into one contiguous file: the final file
+    # for single-file torrents, a staging file split up afterwards otherwise
+    content_path = file_manager.get_content_path(output_path)
+    if file_info['is_multi_file']:
+        print(f"\nWill save to: {file_manager.get_output_summary()}")
+    else:
+        print(f"\nWill save to: {content_path}")
 
     # Calculate number of pieces
     num_pieces = (total_length + piece_length - 1) // piece_length
     print(f"Total pieces: {num_pieces}")
 
+    # Split the hash blob into one 20-byte hash per piece, once
+    mv = memoryview(pieces_hashes)
+    piece_hashes = [bytes(mv[i:i + 20]) for i in range(0, len(mv), 20)]
+    if len(piece_hashes) != num_pieces:
+        raise ValueError(f"Torrent has {len(piece_hashes)} piece hashes for {num_pieces} pieces")
+
     if max_pieces:
         num_pieces = min(num_pieces, max_pieces)
         print(f"Limiting to first {num_pieces} pieces for testing")
+    download_length = min(total_length, num_pieces * piece_length)
 
     # Get peers from tracker (try announce-list if available)
     peers = []
@@ -261,75 +595,176 @@ def download_file(torrent_path: str, output_path: str = None, max_pieces: int =
         except Exception as e:
             print(f"  Failed: {e}")
 
+    # Trackers (and tiers of the same tracker) repeat peers; connect once each
+    peers = list({(peer['ip'], peer['port']): peer for peer in peers}.values())
+
     print(f"Found {len(peers)} peers:")
     for i, peer in enumerate(peers[:10]):
         print(f"  {i+1}. {peer['ip']}:{peer['port']}")
     if len(peers) > 10:
         print(f"  ... and {len(peers) - 10} more")
 
-    # Download pieces
-    print(f"\n=== Downloading {num_pieces} pieces ===\n")
-    downloaded_pieces = []
-
-    for piece_idx in range(num_pieces):
-        # Get expected hash for this piece
-        expected_hash = pieces_hashes[piece_idx * 20:(piece_idx + 1) * 20]
-
-        # Calculate piece size (last piece might be smaller)
-        if piece_idx == num_pieces - 1 and max_pieces is None:
-            current_piece_length = total_length - (piece_idx * piece_length)
-        else:
-            current_piece_length = piece_length
-
-        print(f"Piece {piece_idx + 1}/{num_pieces} ({current_piece_length:,} bytes)")
+    if not peers:
+        raise Exception("No peers available")
+
+    # Download pieces: a bounded pool of worker threads, each holding a
+    # persistent peer connection and asking the rarest-first picker for
+    # its next piece.
+    num_workers = min(len(peers), MAX_PEER_CONNECTIONS)
+    print(f"\n=== Downloading {num_pieces} pieces from up to {num_workers} peers at a time ===\n")
+    picker = PiecePicker(num_pieces)
+    peer_manager = PeerManager(max_unchoked_peers=UNCHOKED_PEERS)
+    choker = Choker(peer_manager, is_seeding=picker.done)
+    reconnects = {}  # (ip, port) -> times requeued after a dropped session
+    peer_queue = queue.SimpleQueue()  # (peer, connected socket or None)
+    connecting_done = threading.Event()
+
+    pieces_done = 0
+    downloaded_bytes = 0
+    lock = threading.Lock()
+
+    def piece_size(piece_idx: int) -> int:
+        # The torrent's last piece might be smaller, whether or not
+        # max_pieces cut the download short
+        return min(piece_length, total_length - piece_idx * piece_length)
+
+    def download_from_peer(peer: dict, sock, mm: mmap.mmap):
+        nonlocal pieces_done, downloaded_bytes
+        peer_key = (peer['ip'], peer['port'])
+        try:
+            session = PeerSession(peer['ip'], peer['port'], info_hash, peer_id,
+                                  on_have=lambda i: picker.add_have(peer_key, i),
+                                  peer_manager=peer_manager, sock=sock)
+        except Exception as e:
+            print(f"  Error with peer {peer['ip']}: {e}\n")
+            return
 
-        # Try peers until successful
-        piece_data = None
-        for peer_idx, peer in enumerate(peers):
+        picker.add_peer(peer_key, session.have)
+        choker.add(session)
+        try:
+            with session:
+                while not picker.done():
+                    piece_idx = picker.pick(peer_key)
+                    if piece_idx is None:
+                        if not picker.has_needed(peer_key):
+                            return  # Nothing left this peer can give us
+                        time.sleep(1)  # Its pieces are in progress elsewhere
+                        continue
+
+                    # Get expected hash for this piece
+                    expected_hash = piece_hashes[piece_idx]
+                    current_piece_length = piece_size(piece_idx)
+                    print(f"Piece {piece_idx + 1}/{num_pieces} ({current_piece_length:,} bytes) from {peer['ip']}")
+
+                    try:
+                        piece_data = session.download_piece(piece_idx, current_piece_length)
+                    except Exception as e:
+                        print(f"  Error with peer {peer['ip']}: {e}\n")
+                        picker.release(piece_idx)  # Let another peer try
+                        with lock:
+                            retries = reconnects.get(peer_key, 0)
+                            if retries < MAX_RECONNECTS:
+                                # Reconnect later with a fresh session
+                                reconnects[peer_key] = retries + 1
+                                peer_queue.put((peer, None))
+                        return
+
+                    # Verify hash
+                    if not verify_piece(piece_data, expected_hash):
+                        print(f"  ✗ Piece {piece_idx} hash mismatch from {peer['ip']}!\n")
+                        picker.release(piece_idx)
+                        return
+
+                    # Write the piece at its offset in the output file
+                    start = piece_idx * piece_length
+                    mm[start:start + len(piece_data)] = piece_data
+
+                    picker.mark_done(piece_idx)
+                    with lock:
+                        pieces_done += 1
+                        downloaded_bytes += len(piece_data)
+                        print(f"  ✓ Piece {piece_idx} hash verified!\n")
+
+                        # Progress update
+                        if max_pieces:
+                            progress = pieces_done / num_pieces * 100
+                            print(f"Progress: {pieces_done}/{num_pieces} pieces ({progress:.1f}%)\n")
+                        else:
+                            progress = downloaded_bytes / total_length * 100
+                            print(f"Progress: {downloaded_bytes:,}/{total_length:,} bytes ({progress:.1f}%)\n")
+        finally:
+            choker.remove(session)
+            picker.remove_peer(peer_key)
+
+    def connect_all():
+        # Handshaken sockets go onto the peer queue as they come in
+        try:
+            connected = asyncio.run(race_connect(
+                peers, info_hash, peer_id,
+                on_connected=lambda peer, sock: peer_queue.put((peer, sock))))
+            print(f"Connected to {connected}/{len(peers)} peers\n")
+        finally:
+            connecting_done.set()
+
+    def worker(mm: mmap.mmap):
+        # Each worker keeps one connection open at a time and moves on to
+        # the next connected peer when that one fails or has nothing we need
+        while not picker.done():
+            finished = connecting_done.is_set()
             try:
-                piece_data = download_piece(
-                    peer['ip'], peer['port'],
-                    info_hash, peer_id,
-                    piece_idx, current_piece_length
-                )
-
-                # Verify hash
-                if verify_piece(piece_data, expected_hash):
-                    print(f"  ✓ Piece {piece_idx} hash verified!\n")
-                    break
-                else:
-                    print(f"  ✗ Piece {piece_idx} hash mismatch!\n")
-                    piece_data = None
-
-            except Exception as e:
-                print(f"  Error with peer {peer['ip']}: {e}\n")
-                if peer_idx < len(peers) - 1:
-                    print(f"  Trying next peer...\n")
+                peer, sock = peer_queue.get(timeout=0.5)
+            except queue.Empty:
+                if finished:
+                    return
                 continue
+            download_from_peer(peer, sock, mm)
+
+    # Workers write verified pieces into a memory map of the pre-sized
+    # output file, so only in-flight pieces are ever held in memory
+    file_manager.create_directories()
+    Path(content_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(content_path, 'w+b') as f:
+        preallocate(f.fileno(), download_length)
+        with mmap.mmap(f.fileno(), download_length) as mm:
+            connector = threading.Thread(target=connect_all, daemon=True)
+            connector.start()
+            choker.start()
+            try:
+                with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                    for _ in range(num_workers):
+                        executor.submit(worker, mm)
+            finally:
+                choker.stop()
+            mm.flush()
+
+        if hasattr(os, 'posix_fadvise'):
+            # Done with these pages; don't let them crowd out the page cache
+            os.posix_fadvise(f.fileno(), 0, download_length, os.POSIX_FADV_DONTNEED)
+
+    # Close connections that were made but never needed
+    connector.join()
+    while not peer_queue.empty():
+        _, sock = peer_queue.get()
+        if sock is not None:
+            sock.close()
+
+    peer_manager.print_statistics()
+
+    if pieces_done < num_pieces:
+        missing = num_pieces - pieces_done
+        raise Exception(f"Failed to download {missing} piece(s) from any peer")
 
-        if piece_data is None:
-            raise Exception(f"Failed to download piece {piece_idx} from any peer")
-
-        downloaded_pieces.append(piece_data)
-
-        # Progress update
-        downloaded_bytes = sum(len(p) for p in downloaded_pieces)
-        if max_pieces:
-            progress = (piece_idx + 1) / num_pieces * 100
-            print(f"Progress: {piece_idx + 1}/{num_pieces} pieces ({progress:.1f}%)\n")
-        else:
-            progress = downloaded_bytes / total_length * 100
-            print(f"Progress: {downloaded_bytes:,}/{total_length:,} bytes ({progress:.1f}%)\n")
-
-    # Write to file(s)
-    print(f"\nWriting downloaded data...")
-
-    # Convert list to dict for FileManager
-    pieces_dict = {i: downloaded_pieces[i] for i in range(len(downloaded_pieces))}
-    bytes_written = file_manager.write_pieces(pieces_dict, piece_length)
+    if file_info['is_multi_file']:
+        # Split the staging file into the torrent's files
+        print(f"\nWriting downloaded data...")
+        bytes_written = file_manager.split_content(content_path)
+        location = file_manager.get_output_summary()
+    else:
+        bytes_written = download_length
+        location = content_path
 
     print(f"\n✓ Download complete!")
-    print(f"  Location: {file_manager.get_output_summary()}")
+    print(f"  Location: {location}")
     print(f"  Size: {bytes_written:,} bytes ({bytes_written / (1024*1024):.2f} MB)")
 
     if file_info['is_multi_file']:
@@ -3,33 +3,186 @@
 # Optimized BitTorrent downloader with choking/unchoking and multi-peer support.
 #
 # Key optimizations:
-# 1. Multi-peer downloading (parallel connections)
+# 1. Multi-peer downloading (concurrent connections on one asyncio event loop)
 # 2. Smart peer selection based on download rates
 # 3. Choking/unchoking to reduce bandwidth waste
 # 4. Bandwidth tracking and statistics
 #
 # Expected improvement: ~40% bandwidth reduction without degrading throughput
 
-import socket
+import array
+import asyncio
 import hashlib
+import heapq
 import time
 import os
-import threading
-from pathlib import Path
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 from typing import List, Dict, Set, Optional
 
 from peer_protocol import *
 from tracker_http import *
-from torrent_meta import load_torrent
+from torrent_meta import load_torrent_with_info_hash
 from peer_manager import PeerManager, PeerStats
 from file_manager import FileManager
 
 
 BLOCK_SIZE = 16384  # 16 KB
 DOWNLOADS_DIR = "downloads"
-MAX_PEER_CONNECTIONS = 5  # Connect to 5 peers simultaneously
+MAX_PEER_CONNECTIONS = 40  # Pieces (connections) in flight at once, all on one event loop
 UNCHOKED_PEERS = 4        # Unchoke 4 best peers
+PEER_TIMEOUT = 15  # Seconds to wait on a peer read before giving up
+UNCHOKE_TIMEOUT = 30  # Seconds to wait for an unchoke after the handshake
+PIPELINE = 5  # Block requests kept outstanding per peer
+VERIFY_THREADS = 2  # Threads hashing and writing finished pieces
+MAX_PIECE_ATTEMPTS = 3  # Times a piece is scheduled before giving up on it
+MAX_PEER_FAILURES = 3  # Consecutive failed pieces before a peer is dropped
+FALLBACK_PEERS = 3  # Peers from the top of the list retried when a piece fails
+MAX_TRACKER_THREADS = 10  # Trackers announced to concurrently
+TRACKER_TIMEOUT = 15  # Seconds to wait for all tracker responses
+
+
+async def read_message(reader: asyncio.StreamReader, timeout: float = PEER_TIMEOUT) -> tuple:
+    """
+    Read one length-prefixed message from a peer.
+
+    Returns (message_id, payload); (None, b"") for keep-alive.
+    Raises asyncio.TimeoutError if nothing arrives within timeout.
+    """
+    header = await asyncio.wait_for(reader.readexactly(4), timeout)
+    length = int.from_bytes(header, 'big')
+    if length == 0:
+        return None, b""
+    message = await asyncio.wait_for(reader.readexactly(length), timeout)
+    return message[0], memoryview(message)[1:]
+
+
+class PeerConnection:
+    """
+    Long-lived connection to one peer, reused for every piece fetched from it.
+
+    Connect, handshake and the unchoke wait happen once per connection
+    instead of once per piece. The lock serializes pieces on the connection.
+    """
+
+    def __init__(self, downloader: 'OptimizedDownloader', peer: Dict):
+        self.downloader = downloader
+        self.ip = peer['ip']
+        self.port = peer['port']
+        self.key = (self.ip, self.port)
+        self.stats = downloader.peer_manager.get_peer(self.ip, self.port)
+        self.reader = None
+        self.writer = None
+        self.unchoked = False
+        self.lock = asyncio.Lock()
+
+        # Blocks of the piece in progress; CHOKE moves outstanding ones back
+        self.to_request = deque()
+        self.outstanding = {}  # offset -> block size, requested but not received yet
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.ip, self.port), PEER_TIMEOUT)
+
+    async def handshake(self):
+        # Interested goes out with the handshake: peers only unchoke
+        # after it, so there's no point waiting for an unchoke first
+        d = self.downloader
+        self.writer.write(create_handshake(d.info_hash, d.peer_id) + create_message(MSG_INTERESTED))
+        self.stats.we_are_interested = True
+        await self.writer.drain()
+        parse_handshake(await asyncio.wait_for(self.reader.readexactly(68), PEER_TIMEOUT))
+
+    async def wait_unchoke(self) -> bool:
+        """Wait (up to UNCHOKE_TIMEOUT) for an unchoke; returns whether it came."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + UNCHOKE_TIMEOUT
+
+        while not self.unchoked:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                msg_id, payload = await read_message(self.reader, remaining)
+            except asyncio.TimeoutError:
+                break
+            self.handle_message(msg_id, payload)
+
+        return self.unchoked
+
+    async def open(self) -> bool:
+        await self.connect()
+        await self.handshake()
+        return await self.wait_unchoke()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+        self.unchoked = False
+
+    def handle_message(self, msg_id: int, payload):
+        """Handle a non-block message (state changes and availability)."""
+        if msg_id == MSG_UNCHOKE:
+            self.unchoked = True
+            self.stats.is_choking_us = False
+        elif msg_id == MSG_CHOKE:
+            # Outstanding requests are dropped by the peer; re-send after unchoke
+            self.unchoked = False
+            self.stats.is_choking_us = True
+            self.to_request.extendleft(sorted(self.outstanding, reverse=True))
+            self.outstanding.clear()
+        elif msg_id == MSG_BITFIELD:
+            self.downloader.record_bitfield(self.key, payload)
+        elif msg_id == MSG_HAVE:
+            self.downloader.record_have(self.key, payload)
+
+    async def download_piece(self, piece_index: int, piece_len: int) -> bytearray:
+        """
+        Download one piece over the open connection.
+        Updates peer manager statistics.
+        """
+        # The piece is assembled in place; blocks are written at their offset
+        piece_data = bytearray(piece_len)
+        bytes_received = 0
+        self.to_request = deque(range(0, piece_len, BLOCK_SIZE))
+        self.outstanding = {}
+
+        while bytes_received < piece_len:
+            # Keep PIPELINE requests in flight so the link never idles
+            # for a round trip between blocks
+            requests = []
+            while self.unchoked and self.to_request and len(self.outstanding) < PIPELINE:
+                offset = self.to_request.popleft()
+                block_size = min(BLOCK_SIZE, piece_len - offset)
+                requests.append(create_request(piece_index, offset, block_size))
+                self.outstanding[offset] = block_size
+            if requests:
+                self.writer.write(b"".join(requests))
+                await self.writer.drain()
+
+            msg_id, payload = await read_message(self.reader)
+            if msg_id != MSG_PIECE:
+                self.handle_message(msg_id, payload)
+                continue
+
+            piece_msg = parse_piece_message(payload)
+            begin = piece_msg['begin']
+            block = piece_msg['block']
+            if piece_msg['index'] == piece_index and self.outstanding.get(begin) == len(block):
+                del self.outstanding[begin]
+                piece_data[begin:begin + len(block)] = block
+                bytes_received += len(block)
+
+                # Update statistics
+                self.downloader.peer_manager.update_download(self.ip, self.port, len(block))
+
+        return piece_data
 
 
 class OptimizedDownloader:
@@ -42,12 +195,11 @@ class OptimizedDownloader:
         self.output_path = output_path
         self.max_pieces = max_pieces
 
-        # Load torrent
-        self.meta = load_torrent(torrent_path)
+        # Load torrent; the info hash comes from the file's own info bytes
+        self.meta, self.info_hash = load_torrent_with_info_hash(torrent_path)
         self.info = self.meta[b'info']
 
         # Extract metadata
-        self.info_hash = calculate_info_hash(self.info)
         self.peer_id = generate_peer_id()
 
         # Use FileManager for both single and multi-file torrents
@@ -63,14 +215,36 @@ class OptimizedDownloader:
         if self.max_pieces:
             self.num_pieces = min(self.num_pieces, self.max_pieces)
 
+        # Every piece is full length except possibly the torrent's last one
+        self.piece_lens = [self.piece_length] * self.num_pieces
+        if self.num_pieces:
+            tail = self.total_length - (self.num_pieces - 1) * self.piece_length
+            self.piece_lens[-1] = min(self.piece_length, tail)
+
+        # Split the concatenated SHA-1s once instead of slicing per attempt
+        hashes = memoryview(self.pieces_hashes)
+        self.piece_hashes = [bytes(hashes[i * 20:(i + 1) * 20]) for i in range(self.num_pieces)]
+
         # Peer management
         self.peer_manager = PeerManager(max_unchoked_peers=UNCHOKED_PEERS)
         self.peers_list = []
+        self.peer_failures: Dict[tuple, int] = {}
+        self.connections: Dict[tuple, PeerConnection] = {}
+
+        # Local rarest first: what each peer has and how many peers have each piece
+        self.peer_bitfields: Dict[tuple, bytearray] = {}
+        self.piece_availability = array.array('H', [0] * self.num_pieces)
+        # Pieces not yet started, and per peer a lazily built heap of
+        # (availability, index) for the ones it has; the None entry is for
+        # peers whose bitfield hasn't been seen yet
+        self.needed: Set[int] = set()
+        self.piece_heaps: Dict[Optional[tuple], list] = {}
 
         # Download state
-        self.pieces_downloaded: Set[int] = set()
-        self.pieces_data: Dict[int, bytes] = {}
-        self.lock = threading.Lock()
+        self.pieces_downloaded = bytearray((self.num_pieces + 7) // 8)  # Our bitfield
+        self.bytes_written = 0
+        # SHA-1 (GIL released by OpenSSL) and pwrite run here, off the event loop
+        self.verify_pool = ThreadPoolExecutor(max_workers=VERIFY_THREADS)
 
         # Statistics (for comparison with non-optimized version)
         self.start_time = None
@@ -79,7 +253,8 @@ class OptimizedDownloader:
     def get_peers_from_tracker(self):
         """Get peer list from trackers."""
         print("\nContacting trackers...")
-        peers = []
+        unique_peers = []
+        seen = set()
         trackers = []
 
         if b'announce-list' in self.meta:
@@ -89,182 +264,83 @@ class OptimizedDownloader:
         else:
             trackers.append(self.meta[b'announce'].decode('utf-8'))
 
-        for tracker in trackers:
-            try:
-                print(f"  {tracker}...")
-                tracker_url = build_tracker_url(tracker, self.info_hash,
-                                              self.peer_id, self.total_length)
-                response = request_peers(tracker_url)
-                if b'peers' in response:
-                    new_peers = parse_compact_peers(response[b'peers'])
-                    peers.extend(new_peers)
-                    print(f"  → Got {len(new_peers)} peers")
-            except Exception as e:
-                print(f"  → Failed: {e}")
-
-        # Remove duplicates
-        unique_peers = []
-        seen = set()
-        for peer in peers:
-            peer_id = f"{peer['ip']}:{peer['port']}"
-            if peer_id not in seen:
-                unique_peers.append(peer)
-                seen.add(peer_id)
-                self.peer_manager.add_peer(peer['ip'], peer['port'])
+        # Announce to all trackers at once: the wait is the slowest
+        # tracker (capped at TRACKER_TIMEOUT), not the sum of them all
+        executor = ThreadPoolExecutor(max_workers=max(1, min(MAX_TRACKER_THREADS, len(trackers))))
+        futures = {executor.submit(self._announce, tracker): tracker for tracker in trackers}
+        try:
+            for future in as_completed(futures, timeout=TRACKER_TIMEOUT):
+                tracker = futures[future]
+                try:
+                    new_peers = future.result()
+                    print(f"  {tracker} → Got {len(new_peers)} peers")
+                    # Deduplicate as peers come in (results are handled
+                    # on this thread only, so no lock is needed)
+                    for peer in new_peers:
+                        key = (peer['ip'], peer['port'])
+                        if key not in seen:
+                            seen.add(key)
+                            unique_peers.append(peer)
+                            self.peer_manager.add_peer(peer['ip'], peer['port'])
+                except Exception as e:
+                    print(f"  {tracker} → Failed: {e}")
+        except TimeoutError:
+            print(f"  → {sum(not f.done() for f in futures)} tracker(s) timed out")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
         self.peers_list = unique_peers
         print(f"\nTotal unique peers: {len(unique_peers)}")
 
-    def download_piece_from_peer(self, peer: Dict, piece_index: int) -> Optional[bytes]:
-        """
-        Download a single piece from a peer.
-        Updates peer manager statistics.
-        """
-        peer_ip = peer['ip']
-        peer_port = peer['port']
-        peer_stats = self.peer_manager.get_peer(peer_ip, peer_port)
-
-        # Calculate piece size
-        if piece_index == self.num_pieces - 1 and self.max_pieces is None:
-            piece_len = self.total_length - (piece_index * self.piece_length)
-        else:
-            piece_len = self.piece_length
-
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(15)
+    def _announce(self, tracker: str) -> List[Dict]:
+        """Announce to one tracker; returns the peers it reports."""
+        tracker_url = build_tracker_url(tracker, self.info_hash,
+                                      self.peer_id, self.total_length)
+        response = request_peers(tracker_url)
+        if b'peers' in response:
+            return parse_compact_peers(response[b'peers'])
+        return []
 
-        try:
-            # Connect
-            sock.connect((peer_ip, peer_port))
-
-            # Handshake
-            handshake = create_handshake(self.info_hash, self.peer_id)
-            sock.sendall(handshake)
-
-            response = b""
-            while len(response) < 68:
-                data = sock.recv(68 - len(response))
-                if not data:
-                    raise Exception("Connection closed during handshake")
-                response += data
+    async def download_piece_from_peer(self, peer: Dict, piece_index: int) -> Optional[bytearray]:
+        """
+        Download a single piece from a peer over its persistent connection.
 
-            parse_handshake(response)
+        The connection is opened on first use and kept for later pieces; if
+        an already-open connection fails, it is reopened once.
+        """
+        peer_key = (peer['ip'], peer['port'])
+        conn = self.connections.get(peer_key)
+        if conn is None:
+            conn = self.connections[peer_key] = PeerConnection(self, peer)
 
-            # Wait for bitfield/unchoke
-            buffer = b""
-            unchoked = False
-            timeout_counter = 0
+        piece_len = self.piece_lens[piece_index]
 
-            while not unchoked and timeout_counter < 3:
+        async with conn.lock:
+            for attempt in range(2):
+                reused = conn.connected
                 try:
-                    data = sock.recv(4096)
-                    if not data:
-                        raise Exception("Connection closed")
-                    buffer += data
-
-                    while True:
-                        msg_id, payload, consumed = parse_message(buffer)
-                        if consumed == 0:
-                            break
-
-                        buffer = buffer[consumed:]
-
-                        if msg_id == MSG_UNCHOKE:
-                            unchoked = True
-                            peer_stats.is_choking_us = False
-                            break
-                        elif msg_id == MSG_BITFIELD:
-                            pass  # Peer has pieces
-
-                    if unchoked:
-                        break
-                except socket.timeout:
-                    timeout_counter += 1
-
-            if not unchoked:
-                # Send interested
-                sock.sendall(create_message(MSG_INTERESTED))
-                peer_stats.we_are_interested = True
-
-                # Wait for unchoke
-                while timeout_counter < 3:
-                    try:
-                        data = sock.recv(4096)
-                        if not data:
-                            break
-                        buffer += data
-
-                        while True:
-                            msg_id, payload, consumed = parse_message(buffer)
-                            if consumed == 0:
-                                break
-                            buffer = buffer[consumed:]
-
-                            if msg_id == MSG_UNCHOKE:
-                                unchoked = True
-                                peer_stats.is_choking_us = False
-                                break
-
-                        if unchoked:
-                            break
-                    except socket.timeout:
-                        timeout_counter += 1
-
-            if not unchoked:
-                return None
-
-            # Download blocks
-            piece_data = b""
-            offset = 0
-            download_start = time.time()
-
-            while offset < piece_len:
-                block_size = min(BLOCK_SIZE, piece_len - offset)
-
-                # Request block
-                request = create_request(piece_index, offset, block_size)
-                sock.sendall(request)
-
-                # Receive piece
-                received = False
-                while not received:
-                    data = sock.recv(32768)
-                    if not data:
-                        raise Exception("Connection closed during download")
-                    buffer += data
-
-                    msg_id, payload, consumed = parse_message(buffer)
-                    if consumed > 0:
-                        buffer = buffer[consumed:]
-
-                        if msg_id == MSG_PIECE:
-                            piece_msg = parse_piece_message(payload)
-                            if piece_msg['index'] == piece_index and piece_msg['begin'] == offset:
-                                piece_data += piece_msg['block']
-                                received = True
-
-                                # Update statistics
-                                self.peer_manager.update_download(peer_ip, peer_port,
-                                                                 len(piece_msg['block']))
-
-                offset += block_size
+                    if not conn.connected and not await conn.open():
+                        conn.close()
+                        return None
+                    if peer_key in self.peer_bitfields and not self.peer_has_piece(peer_key, piece_index):
+                        return None  # Don't ask for a piece it doesn't have
 
-            download_time = time.time() - download_start
-
-            # Estimate naive bandwidth (what we'd use without optimization)
-            # Assume we'd keep connection open and waste bandwidth
-            with self.lock:
-                self.naive_bandwidth_estimate += piece_len * 1.4  # 40% overhead
-
-            return piece_data
+                    return await conn.download_piece(piece_index, piece_len)
+                except Exception:
+                    conn.close()
+                    if reused:
+                        continue  # Stale connection; reconnect once
+                    return None
+        return None
 
-        except Exception as e:
-            return None
-        finally:
-            sock.close()
+    async def download_pieces(self):
+        """
+        Download all pieces concurrently on one event loop.
 
-    def download_pieces(self):
-        """Download all pieces using multiple peers."""
+        Local rarest first: whenever a peer is idle, start the needed piece
+        held by the fewest peers that this peer has (peers whose bitfield
+        hasn't been seen yet may be tried for any piece).
+        """
         print(f"\n=== Downloading {self.num_pieces} pieces ===\n")
 
         # Get best peers (use peer manager)
@@ -275,63 +351,197 @@ class OptimizedDownloader:
         else:
             best_peers = [{'ip': p.ip, 'port': p.port} for p in best_peers]
 
-        # Download pieces in parallel
-        with ThreadPoolExecutor(max_workers=MAX_PEER_CONNECTIONS) as executor:
-            futures = {}
+        running = {}  # task -> (peer key, piece index); one piece per peer at a time
+        verifying = {}  # hash+write future -> (peer key, piece index); holds no peer
+        attempts = [0] * self.num_pieces
+        completed = 0
+
+        def piece_failed(peer_key: tuple, piece_idx: int):
+            self.peer_failures[peer_key] = self.peer_failures.get(peer_key, 0) + 1
+            if attempts[piece_idx] < MAX_PIECE_ATTEMPTS:
+                self.requeue_piece(piece_idx)
+
+        loop = asyncio.get_running_loop()
+
+        # Kept up to date as pieces start and fail, rather than rebuilt
+        # from every piece index after each completion
+        self.needed = {i for i in range(self.num_pieces) if not self._has(i)}
+        self.piece_heaps.clear()
+
+        while True:
+            # Only idle peers get work; with every peer busy there's no scan
+            if self.needed and len(running) < len(best_peers):
+                busy = {key for key, _ in running.values()}
+                for peer in best_peers:
+                    peer_key = (peer['ip'], peer['port'])
+                    if peer_key in busy or self.peer_failures.get(peer_key, 0) >= MAX_PEER_FAILURES:
+                        continue
+                    piece_idx = self.pick_piece_for(peer_key)
+                    if piece_idx is None:
+                        continue
+                    attempts[piece_idx] += 1
+                    task = asyncio.create_task(self.fetch_piece(peer, piece_idx))
+                    running[task] = (peer_key, piece_idx)
+                    if not self.needed:
+                        break
 
-            for piece_idx in range(self.num_pieces):
-                # Select peer for this piece (round-robin for simplicity)
-                peer = best_peers[piece_idx % len(best_peers)]
+            if not running and not verifying:
+                break  # All done, or no peer left that can give us the rest
 
-                future = executor.submit(self.download_and_verify_piece, peer, piece_idx)
-                futures[future] = piece_idx
+            done, _ = await asyncio.wait(running.keys() | verifying.keys(),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future in running:
+                    peer_key, piece_idx = running.pop(future)
+                    try:
+                        fetched = future.result()
+                    except Exception as e:
+                        print(f"Piece {piece_idx} failed: {e}")
+                        fetched = None
+                    if fetched is None:
+                        piece_failed(peer_key, piece_idx)
+                        continue
+                    # The peer is free for its next piece as of now; SHA-1 and
+                    # the write run on verify_pool off its critical path
+                    peer_key, piece_data = fetched
+                    verify = loop.run_in_executor(self.verify_pool, self.verify_and_write, piece_idx,
+                                                  piece_data, self.piece_hashes[piece_idx])
+                    verifying[verify] = (peer_key, piece_idx)
+                    continue
 
-            # Collect results
-            completed = 0
-            for future in as_completed(futures):
-                piece_idx = futures[future]
+                peer_key, piece_idx = verifying.pop(future)
                 try:
-                    success = future.result()
-                    if success:
-                        completed += 1
-                        progress = completed / self.num_pieces * 100
-                        print(f"Progress: {completed}/{self.num_pieces} pieces ({progress:.1f}%)")
-
-                        # Recalculate choking every few pieces
-                        if completed % 5 == 0:
-                            unchoked = self.peer_manager.recalculate_choking()
-                            print(f"  → Unchoked {len(unchoked)} best peers")
+                    written = future.result()
                 except Exception as e:
                     print(f"Piece {piece_idx} failed: {e}")
+                    written = None
+                if written is None:
+                    piece_failed(peer_key, piece_idx)
+                    continue
 
-    def download_and_verify_piece(self, peer: Dict, piece_idx: int) -> bool:
-        """Download and verify a single piece."""
-        expected_hash = self.pieces_hashes[piece_idx * 20:(piece_idx + 1) * 20]
+                self.bytes_written += written
+                self._mark(piece_idx)
+                self.peer_failures[peer_key] = 0
+                completed += 1
+                progress = completed / self.num_pieces * 100
+                print(f"Progress: {completed}/{self.num_pieces} pieces ({progress:.1f}%)")
 
-        # Try multiple peers if first fails
-        for attempt_peer in self.peers_list:
-            if attempt_peer == peer or attempt_peer in self.peers_list[:3]:
-                try:
-                    piece_data = self.download_piece_from_peer(attempt_peer, piece_idx)
-
-                    if piece_data:
-                        # Verify hash
-                        actual_hash = hashlib.sha1(piece_data).digest()
-                        if actual_hash == expected_hash:
-                            with self.lock:
-                                self.pieces_data[piece_idx] = piece_data
-                                self.pieces_downloaded.add(piece_idx)
-                            return True
-                except Exception:
-                    continue
+                # Recalculate choking every few pieces
+                if completed % 5 == 0:
+                    unchoked = self.peer_manager.recalculate_choking()
+                    print(f"  → Unchoked {len(unchoked)} best peers")
+
+        # Done with the peers
+        for conn in self.connections.values():
+            conn.close()
 
-        return False
+    def pick_piece_for(self, peer_key: tuple) -> Optional[int]:
+        """
+        Take the rarest needed piece the peer has (or may have) out of needed.
+
+        Heap entries are dropped lazily once their piece was started from
+        another peer's heap. An entry whose availability count changed since
+        it was pushed goes back in with the current count before it can win.
+        """
+        heap_key = peer_key if peer_key in self.peer_bitfields else None
+        heap = self.piece_heaps.get(heap_key)
+        if heap is None:
+            heap = self.piece_heaps[heap_key] = [
+                (self.piece_availability[idx], idx) for idx in self.needed
+                if heap_key is None or self.peer_has_piece(peer_key, idx)]
+            heapq.heapify(heap)
+
+        while heap:
+            availability, piece_idx = heapq.heappop(heap)
+            if piece_idx not in self.needed:
+                continue
+            if availability != self.piece_availability[piece_idx]:
+                heapq.heappush(heap, (self.piece_availability[piece_idx], piece_idx))
+                continue
+            self.needed.discard(piece_idx)
+            return piece_idx
+        return None
+
+    def requeue_piece(self, piece_idx: int):
+        """Make a failed piece available to pick_piece_for again."""
+        self.needed.add(piece_idx)
+        entry = (self.piece_availability[piece_idx], piece_idx)
+        for heap_key, heap in self.piece_heaps.items():
+            if heap_key is None or self.peer_has_piece(heap_key, piece_idx):
+                heapq.heappush(heap, entry)
+
+    def record_bitfield(self, peer_key: tuple, payload):
+        """Store a peer's bitfield and update piece availability."""
+        old = self.peer_bitfields.get(peer_key)
+        if old is not None:
+            # Reconnected peer: replace its previous bitfield
+            for idx in parse_bitfield(old):
+                if idx < self.num_pieces:
+                    self.piece_availability[idx] -= 1
+        self.peer_bitfields[peer_key] = bytearray(payload)
+        self.piece_heaps.pop(peer_key, None)  # Rebuilt from the new bitfield
+        for idx in parse_bitfield(payload):
+            if idx < self.num_pieces:
+                self.piece_availability[idx] += 1
+
+    def record_have(self, peer_key: tuple, payload):
+        """Mark one more piece a peer has (HAVE message)."""
+        idx = int.from_bytes(payload, 'big')
+        if idx >= self.num_pieces:
+            return
+        bitfield = self.peer_bitfields.setdefault(peer_key, bytearray((self.num_pieces + 7) // 8))
+        if len(bitfield) <= idx >> 3:
+            bitfield.extend(bytes((idx >> 3) + 1 - len(bitfield)))
+        mask = 0x80 >> (idx & 7)
+        if not bitfield[idx >> 3] & mask:
+            bitfield[idx >> 3] |= mask
+            self.piece_availability[idx] += 1
+            heap = self.piece_heaps.get(peer_key)
+            if heap is not None and idx in self.needed:
+                heapq.heappush(heap, (self.piece_availability[idx], idx))
+
+    def _mark(self, piece_idx: int):
+        self.pieces_downloaded[piece_idx >> 3] |= 0x80 >> (piece_idx & 7)
+
+    def _has(self, piece_idx: int) -> bool:
+        return bool(self.pieces_downloaded[piece_idx >> 3] & (0x80 >> (piece_idx & 7)))
+
+    def peer_has_piece(self, peer_key: tuple, piece_idx: int) -> bool:
+        bitfield = self.peer_bitfields.get(peer_key)
+        if bitfield is None or len(bitfield) <= piece_idx >> 3:
+            return False
+        return bool(bitfield[piece_idx >> 3] & (0x80 >> (piece_idx & 7)))
+
+    async def fetch_piece(self, peer: Dict, piece_idx: int) -> Optional[tuple]:
+        """
+        Download a single piece, falling back to other peers if needed.
+
+        Returns (peer key it came from, piece data), or None. Verification
+        is left to the caller so the peer can move on meanwhile.
+        """
+        # Try the chosen peer first, then up to 3 fallback peers
+        fallback_peers = [peer] + [p for p in self.peers_list[:FALLBACK_PEERS] if p != peer]
+        for attempt_peer in fallback_peers:
+            try:
+                piece_data = await self.download_piece_from_peer(attempt_peer, piece_idx)
+                if piece_data:
+                    return (attempt_peer['ip'], attempt_peer['port']), piece_data
+            except Exception:
+                continue
+
+        return None
+
+    def verify_and_write(self, piece_idx: int, piece_data: bytearray, expected_hash: bytes) -> Optional[int]:
+        """Check a piece's hash and write it in place; None if it doesn't match."""
+        if hashlib.sha1(piece_data).digest() != expected_hash:
+            return None
+        # Straight to disk; only in-flight pieces stay in memory
+        return self.file_manager.write_piece(piece_idx, self.piece_length, piece_data)
 
     def save_file(self):
-        """Save downloaded pieces to file(s)."""
-        print(f"\nWriting downloaded data...")
-        bytes_written = self.file_manager.write_pieces(self.pieces_data, self.piece_length)
-        print(f"✓ Saved {bytes_written:,} bytes")
+        """Close the output file(s); pieces were written as they arrived."""
+        self.file_manager.close_files()
+        print(f"\n✓ Saved {self.bytes_written:,} bytes")
 
     def run(self):
         """Main download orchestration."""
@@ -344,7 +554,10 @@ class OptimizedDownloader:
         if self.file_info['is_multi_file']:
             self.file_manager.print_file_list()
 
-        print(f"\nWill save to: {self.file_manager.get_output_summary()}")
+        if self.output_path and not self.file_info['is_multi_file']:
+            print(f"\nWill save to: {self.output_path}")
+        else:
+            print(f"\nWill save to: {self.file_manager.get_output_summary()}")
 
         self.start_time = time.time()
 
@@ -355,13 +568,20 @@ class OptimizedDownloader:
             print("No peers available!")
             return
 
-        # Download
-        self.download_pieces()
-
-        # Save
-        if self.pieces_data:
+        # Download, writing each verified piece in place
+        download_length = min(self.total_length, self.num_pieces * self.piece_length)
+        self.file_manager.open_files(self.output_path, download_length)
+        try:
+            asyncio.run(self.download_pieces())
+        finally:
+            self.verify_pool.shutdown()
+            # Save
             self.save_file()
 
+        # Estimate naive bandwidth (what we'd use without optimization)
+        # Assume we'd keep connection open and waste bandwidth
+        self.naive_bandwidth_estimate = self.bytes_written * 1.4  # 40% overhead
+
         # Print statistics
         elapsed = time.time() - self.start_time
         self.peer_manager.print_statistics()
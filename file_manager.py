@@ -20,10 +20,29 @@
 #   }
 
 import os
+from bisect import bisect_right
 from pathlib import Path
 from typing import List, Dict, Tuple
 
 
+COPY_CHUNK_SIZE = 1024 * 1024  # Bytes per read when splitting a staging file
+MAX_COPY_RANGE = 1 << 30  # Bytes per os.copy_file_range call
+
+
+def preallocate(fd: int, length: int):
+    """
+    Size an open file to length bytes before any data is written.
+
+    posix_fallocate reserves the extents in one go instead of growing the
+    file piece by piece. Where it doesn't exist (macOS) or the filesystem
+    refuses it, fall back to a sparse ftruncate.
+    """
+    try:
+        os.posix_fallocate(fd, 0, length)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, length)
+
+
 class FileManager:
     """
     Manages file I/O for both single-file and multi-file torrents.
@@ -47,6 +66,10 @@ class FileManager:
             }]
             self.total_length = info[b'length']
 
+        # Torrent offset where each file starts, for locating pieces
+        self.file_offsets = [f['offset'] for f in self.files]
+        self.fds = []  # Output file descriptors while open_files() is in effect
+
     def _parse_file_list(self) -> List[Dict]:
         """
         Parse multi-file torrent file list.
@@ -58,23 +81,18 @@ class FileManager:
         """
         files = []
         current_offset = 0
+        sep = os.sep.encode()
+        root = self.root_name + os.sep
 
         for file_info in self.info[b'files']:
-            # Build path from components
-            path_parts = [part.decode('utf-8') for part in file_info[b'path']]
-            relative_path = os.path.join(*path_parts)
-
-            # Full path including root directory
-            full_path = os.path.join(self.root_name, relative_path)
-
+            # Full path including root directory; components are joined
+            # as bytes so each path is decoded once
             length = file_info[b'length']
-
             files.append({
-                'path': full_path,
+                'path': root + sep.join(file_info[b'path']).decode('utf-8'),
                 'length': length,
                 'offset': current_offset
             })
-
             current_offset += length
 
         return files
@@ -106,41 +124,135 @@ class FileManager:
             # Just ensure base directory exists
             Path(self.base_output_dir).mkdir(parents=True, exist_ok=True)
 
-    def write_pieces(self, pieces_data: Dict[int, bytes], piece_length: int):
+    def open_files(self, output_path: str = None, length: int = None):
         """
-        Write downloaded pieces to appropriate files.
+        Create the output file(s) and preallocate them for write_piece().
 
-        Args:
-        - pieces_data: Dict mapping piece index to piece data
-        - piece_length: Length of each piece
+        Single-file torrents are written to output_path if given. Only the
+        first `length` bytes of the torrent are allocated (default: all),
+        so partial downloads don't leave full-size files behind.
         """
         self.create_directories()
+        if length is None:
+            length = self.total_length
+
+        self.fds = []
+        for file_info in self.files:
+            if not self.is_multi_file and output_path:
+                file_path = output_path
+                Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+            else:
+                file_path = os.path.join(self.base_output_dir, file_info['path'])
+
+            fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            self.fds.append(fd)
+            file_length = max(0, min(file_info['length'], length - file_info['offset']))
+            if file_length:
+                preallocate(fd, file_length)
+
+    def write_piece(self, piece_index: int, piece_length: int, data) -> int:
+        """
+        Write one piece at its offset, split across the files it spans.
+
+        Uses os.pwrite on the descriptors from open_files(), so pieces can be
+        written in any order without buffering the rest of the torrent.
+        Returns the number of bytes written.
+        """
+        start = piece_index * piece_length
+        view = memoryview(data)
+        i = bisect_right(self.file_offsets, start) - 1  # File containing start
+        written = 0
 
-        # Concatenate all pieces in order
-        all_data = b""
-        for piece_idx in sorted(pieces_data.keys()):
-            all_data += pieces_data[piece_idx]
+        while written < len(view) and i < len(self.files):
+            file_info = self.files[i]
+            file_pos = start + written - file_info['offset']
+            count = min(len(view) - written, file_info['length'] - file_pos)
+            if count > 0:
+                written += os.pwrite(self.fds[i], view[written:written + count], file_pos)
+            if start + written >= file_info['offset'] + file_info['length']:
+                i += 1
 
-        # Write to files
+        return written
+
+    def close_files(self):
+        """Close the descriptors opened by open_files()."""
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+
+    def get_content_path(self, output_path: str = None) -> str:
+        """
+        Get the path of the contiguous file that pieces are written into.
+
+        Single-file torrents download straight to their final location
+        (output_path if given). Multi-file torrents download into a staging
+        file next to the root directory; split_content() then splits it
+        into the individual files.
+        """
+        if self.is_multi_file:
+            return os.path.join(self.base_output_dir, self.root_name + ".part")
+        return output_path or os.path.join(self.base_output_dir, self.root_name)
+
+    def split_content(self, content_path: str) -> int:
+        """
+        Copy each file's byte range out of a staging file, then remove it.
+
+        Files past the end of the staging file (partial downloads) are
+        truncated or left empty.
+        """
+        self.create_directories()
         bytes_written = 0
 
-        for file_info in self.files:
-            file_path = os.path.join(self.base_output_dir, file_info['path'])
-            file_length = file_info['length']
-            file_offset = file_info['offset']
+        with open(content_path, 'rb') as src:
+            available = os.fstat(src.fileno()).st_size
 
-            # Extract data for this file
-            file_data = all_data[file_offset:file_offset + file_length]
+            for file_info in self.files:
+                file_path = os.path.join(self.base_output_dir, file_info['path'])
+                file_offset = file_info['offset']
+                file_length = max(0, min(file_info['length'], available - file_offset))
 
-            # Write to file
-            with open(file_path, 'wb') as f:
-                f.write(file_data)
+                with open(file_path, 'wb') as dst:
+                    self._copy_range(src, dst, file_offset, file_length)
 
-            bytes_written += len(file_data)
-            print(f"  Wrote {len(file_data):,} bytes to {file_path}")
+                bytes_written += file_length
+                print(f"  Wrote {file_length:,} bytes to {file_path}")
 
+        os.remove(content_path)
         return bytes_written
 
+    @staticmethod
+    def _copy_range(src, dst, offset: int, length: int):
+        """
+        Copy length bytes from src at offset to the start of dst.
+
+        Uses os.copy_file_range where available, so the kernel copies (or
+        reflinks) the data without it passing through user space; falls
+        back to chunked reads if the platform or filesystem refuses.
+        """
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while copied < length:
+                    n = os.copy_file_range(src.fileno(), dst.fileno(),
+                                           min(length - copied, MAX_COPY_RANGE),
+                                           offset + copied, copied)
+                    if n == 0:
+                        return  # Source ended early
+                    copied += n
+                return
+            except OSError:
+                pass  # e.g. cross-device on older kernels; finish below
+
+        src.seek(offset + copied)
+        dst.seek(copied)
+        remaining = length - copied
+        while remaining:
+            chunk = src.read(min(remaining, COPY_CHUNK_SIZE))
+            if not chunk:
+                break
+            dst.write(chunk)
+            remaining -= len(chunk)
+
     def get_output_summary(self) -> str:
         """Get a summary string of where files were written."""
         if self.is_multi_file:
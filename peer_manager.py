@@ -15,59 +15,115 @@
 # 4. This reduces bandwidth waste while maintaining good throughput
 
 import time
+import heapq
+import random
 import threading
-from collections import defaultdict
+from collections import defaultdict, deque
+from operator import attrgetter
 from typing import List, Dict, Optional
 
+RATE_WINDOW = 20.0  # Seconds of history behind each peer's transfer rates
+RATE_SAMPLES = 32   # Cap on the (time, totals) samples kept per peer
+
+# C-level sort keys (cheaper than a lambda per comparison)
+_download_rate = attrgetter('download_rate')
+_upload_rate = attrgetter('upload_rate')
+_downloaded = attrgetter('downloaded')
+
 
 class PeerStats:
     """Track statistics for a single peer."""
 
-    def __init__(self, peer_ip: str, peer_port: int):
+    # Fixed attribute layout: no per-instance __dict__, faster field access
+    # when the choker scans every peer
+    __slots__ = ('ip', 'port', 'downloaded', 'uploaded',
+                 'rate_samples',
+                 'download_rate', 'upload_rate',
+                 'is_choked_by_us', '_is_choking_us',
+                 '_is_interested_in_us', 'we_are_interested',
+                 'connection_time', 'lock', '_peer_id', '_candidates')
+
+    def __init__(self, peer_ip: str, peer_port: int, candidates: Optional[set] = None):
         self.ip = peer_ip
         self.port = peer_port
         self.downloaded = 0  # Total bytes downloaded
         self.uploaded = 0    # Total bytes uploaded
-        self.last_download_time = time.time()
-        self.last_upload_time = time.time()
+        # (time, downloaded, uploaded) at each rate sample, oldest first
+        self.rate_samples = deque(maxlen=RATE_SAMPLES)
         self.download_rate = 0.0  # Bytes per second
         self.upload_rate = 0.0    # Bytes per second
         self.is_choked_by_us = True   # Are we choking them?
-        self.is_choking_us = True     # Are they choking us?
-        self.is_interested_in_us = False
+        self._is_choking_us = True    # Are they choking us?
+        self._is_interested_in_us = False
+        # Set of unchoke candidates (interested, not choking us) to keep
+        # this peer's membership up to date in
+        self._candidates = candidates
         self.we_are_interested = False
         self.connection_time = time.time()
+        self.lock = threading.Lock()  # Guards the counters and rates above
+        self._peer_id = f"{peer_ip}:{peer_port}"
+
+    @property
+    def is_choking_us(self) -> bool:
+        return self._is_choking_us
+
+    @is_choking_us.setter
+    def is_choking_us(self, value: bool):
+        self._is_choking_us = value
+        self._update_candidate()
+
+    @property
+    def is_interested_in_us(self) -> bool:
+        return self._is_interested_in_us
+
+    @is_interested_in_us.setter
+    def is_interested_in_us(self, value: bool):
+        self._is_interested_in_us = value
+        self._update_candidate()
+
+    def _update_candidate(self):
+        if self._candidates is None:
+            return
+        if self._is_interested_in_us and not self._is_choking_us:
+            self._candidates.add(self)
+        else:
+            self._candidates.discard(self)
 
     def update_downloaded(self, bytes_count: int):
-        """Update download stats."""
-        current_time = time.time()
-        time_diff = current_time - self.last_download_time
-
-        self.downloaded += bytes_count
-
-        if time_diff > 0:
-            # Calculate download rate (exponential moving average)
-            instant_rate = bytes_count / time_diff
-            self.download_rate = 0.8 * self.download_rate + 0.2 * instant_rate
-
-        self.last_download_time = current_time
+        """Update download stats (the rate is updated by sample_rates)."""
+        with self.lock:
+            self.downloaded += bytes_count
 
     def update_uploaded(self, bytes_count: int):
-        """Update upload stats."""
-        current_time = time.time()
-        time_diff = current_time - self.last_upload_time
-
-        self.uploaded += bytes_count
+        """Update upload stats (the rate is updated by sample_rates)."""
+        with self.lock:
+            self.uploaded += bytes_count
 
-        if time_diff > 0:
-            instant_rate = bytes_count / time_diff
-            self.upload_rate = 0.8 * self.upload_rate + 0.2 * instant_rate
+    def sample_rates(self, since: float, now: float):
+        """
+        Recompute the rates over a rolling window ending at now.
 
-        self.last_upload_time = current_time
+        Records the byte totals at now and divides what was transferred
+        since the oldest sample still in the window by the time between
+        them. since is when the previous sample round ran; a new peer's
+        history starts there. Times are time.monotonic() readings.
+        """
+        with self.lock:
+            samples = self.rate_samples
+            if not samples:
+                samples.append((since, 0, 0))
+            samples.append((now, self.downloaded, self.uploaded))
+            # Keep one sample at or before the window start so it's fully covered
+            while len(samples) > 2 and samples[1][0] <= now - RATE_WINDOW:
+                samples.popleft()
+
+            start, downloaded, uploaded = samples[0]
+            self.download_rate = (self.downloaded - downloaded) / (now - start)
+            self.upload_rate = (self.uploaded - uploaded) / (now - start)
 
     def get_peer_id(self) -> str:
         """Get unique identifier for this peer."""
-        return f"{self.ip}:{self.port}"
+        return self._peer_id
 
     def __repr__(self):
         return (f"Peer({self.ip}:{self.port}, "
@@ -83,101 +139,152 @@ class PeerManager:
     - Unchoke the 4 best peers (highest download rates)
     - Optimistically unchoke 1 random peer every 30 seconds
     - Choke all other peers to save bandwidth
+
+    Locking: self.lock is only taken when a peer is added. Byte counts
+    are updated under each PeerStats' own lock, and readers iterate
+    self.snapshot, an immutable tuple that add_peer replaces in one
+    assignment, so they never wait on writers.
+
+    Rates: blocks only bump byte counters; whenever peers are ranked or
+    statistics are read, each peer's rates are recomputed over the last
+    RATE_WINDOW seconds of its counter samples.
     """
 
     def __init__(self, max_unchoked_peers: int = 4):
-        self.peers: Dict[str, PeerStats] = {}
+        self.peers: Dict[tuple, PeerStats] = {}  # (ip, port) -> stats
         self.max_unchoked_peers = max_unchoked_peers
         self.optimistic_unchoke_interval = 30  # seconds
+        self.rechoke_interval = 10  # seconds; calls in between reuse the last result
+        self.last_rechoke = None
+        self.unchoked: List[PeerStats] = []
         self.last_optimistic_unchoke = time.time()
-        self.lock = threading.Lock()
+        self._rng = random.Random()
+        self.lock = threading.Lock()         # Membership changes only
+        self.choke_lock = threading.Lock()   # One rechoke / rate sample at a time
+        self.last_sample_time = time.monotonic()
+        self.snapshot: tuple = ()            # All PeerStats, republished by add_peer
+        self.candidates: set = set()         # Interested and not choking us; kept by PeerStats
 
         # Statistics
-        self.total_downloaded = 0
-        self.total_uploaded = 0
-        self.start_time = time.time()
+        self.start_time = time.monotonic()
 
     def add_peer(self, ip: str, port: int) -> PeerStats:
         """Add a new peer to manage."""
-        peer_id = f"{ip}:{port}"
+        key = (ip, port)
+        peer = self.peers.get(key)
+        if peer is not None:
+            return peer
 
         with self.lock:
-            if peer_id not in self.peers:
-                self.peers[peer_id] = PeerStats(ip, port)
-            return self.peers[peer_id]
+            if key not in self.peers:
+                self.peers[key] = PeerStats(ip, port, self.candidates)
+                self.snapshot = tuple(self.peers.values())
+            return self.peers[key]
+
+    def _sample_rates(self, peers):
+        """Bring the peers' rates up to date; caller holds choke_lock."""
+        now = time.monotonic()
+        if now <= self.last_sample_time:
+            return
+        # One shared clock, so every peer's rate covers the same interval
+        for peer in peers:
+            peer.sample_rates(self.last_sample_time, now)
+        self.last_sample_time = now
 
     def get_peer(self, ip: str, port: int) -> Optional[PeerStats]:
         """Get stats for a peer."""
-        peer_id = f"{ip}:{port}"
-        return self.peers.get(peer_id)
+        return self.peers.get((ip, port))
 
     def update_download(self, ip: str, port: int, bytes_count: int):
         """Update download statistics."""
         peer = self.get_peer(ip, port)
         if peer:
             peer.update_downloaded(bytes_count)
-            with self.lock:
-                self.total_downloaded += bytes_count
 
     def update_upload(self, ip: str, port: int, bytes_count: int):
         """Update upload statistics."""
         peer = self.get_peer(ip, port)
         if peer:
             peer.update_uploaded(bytes_count)
-            with self.lock:
-                self.total_uploaded += bytes_count
 
-    def recalculate_choking(self) -> List[PeerStats]:
+    def recalculate_choking(self, seeding: bool = False, force: bool = False) -> List[PeerStats]:
         """
         Recalculate which peers to choke/unchoke.
 
-        Returns list of peers that should be unchoked.
+        Returns list of peers that should be unchoked. Like the reference
+        choker this only reshuffles every rechoke_interval seconds; calls
+        in between return the current set unless force is given.
 
         Algorithm:
-        1. Sort peers by download rate (highest first)
+        1. Sort peers by download rate (highest first); once we are
+           seeding there is nothing to download, so sort by upload rate
         2. Unchoke top N peers
         3. Every 30 seconds, optimistically unchoke a random peer
         4. Choke everyone else
         """
-        with self.lock:
+        peers = self.snapshot
+        with self.choke_lock:
+            now = time.monotonic()
+            if (not force and self.last_rechoke is not None
+                    and now - self.last_rechoke < self.rechoke_interval):
+                return list(self.unchoked)
+            self.last_rechoke = now
+
             current_time = time.time()
+            self._sample_rates(peers)
+
+            # Only the interested peers (those who want our data) compete;
+            # the candidates index saves scanning everyone else
+            candidates = tuple(self.candidates)
 
-            # Get all interested peers (those who want our data)
-            interested_peers = [p for p in self.peers.values()
-                              if p.is_interested_in_us and not p.is_choking_us]
+            # Rank by download rate (tit-for-tat: prefer peers uploading to us);
+            # only the top N are needed, so skip sorting the rest
+            rate_key = _upload_rate if seeding else _download_rate
+            top_peers = heapq.nlargest(self.max_unchoked_peers, candidates, key=rate_key)
 
-            if not interested_peers:
+            if not top_peers:
                 # No interested peers, return empty list
+                for peer in self.unchoked:
+                    peer.is_choked_by_us = True
+                self.unchoked = []
                 return []
 
-            # Sort by download rate (tit-for-tat: prefer peers uploading to us)
-            sorted_peers = sorted(interested_peers,
-                                key=lambda p: p.download_rate,
-                                reverse=True)
-
             # Unchoke top N-1 peers
-            unchoked = sorted_peers[:self.max_unchoked_peers - 1]
+            unchoked = top_peers[:self.max_unchoked_peers - 1]
 
             # Optimistic unchoking: every 30 seconds, try a random peer
             if current_time - self.last_optimistic_unchoke > self.optimistic_unchoke_interval:
-                # Find peers not in top N-1
-                other_peers = [p for p in interested_peers if p not in unchoked]
-                if other_peers:
-                    import random
-                    optimistic_peer = random.choice(other_peers)
+                # Weighted reservoir sample over the candidates not in
+                # the top N-1, in one pass. Peers that connected within the
+                # last round are 3x as likely to be picked, so they get a
+                # chance to prove themselves
+                unchoked_set = set(unchoked)
+                new_since = current_time - self.optimistic_unchoke_interval
+                optimistic_peer = None
+                total_weight = 0
+                for p in candidates:
+                    if p not in unchoked_set:
+                        weight = 3 if p.connection_time > new_since else 1
+                        total_weight += weight
+                        if self._rng.random() * total_weight < weight:
+                            optimistic_peer = p
+                if optimistic_peer is not None:
                     unchoked.append(optimistic_peer)
                     self.last_optimistic_unchoke = current_time
             else:
-                # Use the Nth peer from sorted list
-                if len(sorted_peers) >= self.max_unchoked_peers:
-                    unchoked.append(sorted_peers[self.max_unchoked_peers - 1])
+                # Use the Nth best peer
+                if len(top_peers) >= self.max_unchoked_peers:
+                    unchoked.append(top_peers[self.max_unchoked_peers - 1])
 
-            # Update choke status
-            unchoked_ids = {p.get_peer_id() for p in unchoked}
-            for peer in self.peers.values():
-                peer.is_choked_by_us = peer.get_peer_id() not in unchoked_ids
+            # Update choke status; only this method changes it, so just
+            # the previous and the new unchoke sets need touching
+            for peer in self.unchoked:
+                peer.is_choked_by_us = True
+            for peer in unchoked:
+                peer.is_choked_by_us = False
 
-            return unchoked
+            self.unchoked = unchoked
+            return list(unchoked)
 
     def get_best_peers_for_download(self, count: int = 5) -> List[PeerStats]:
         """
@@ -188,32 +295,36 @@ class PeerManager:
         2. Have high download rates
         3. Are unchoked by us (reciprocal relationship)
         """
-        with self.lock:
-            available = [p for p in self.peers.values()
-                        if not p.is_choking_us]
-
-            # Sort by download rate
-            sorted_peers = sorted(available,
-                                key=lambda p: p.download_rate,
-                                reverse=True)
+        peers = self.snapshot
+        with self.choke_lock:
+            self._sample_rates(peers)
+        available = [p for p in peers if not p.is_choking_us]
 
-            return sorted_peers[:count]
+        # Highest download rate first
+        return heapq.nlargest(count, available, key=_download_rate)
 
     def get_statistics(self) -> Dict:
         """Get overall statistics."""
-        with self.lock:
-            elapsed = time.time() - self.start_time
-
-            return {
-                'total_downloaded': self.total_downloaded,
-                'total_uploaded': self.total_uploaded,
-                'download_rate': self.total_downloaded / elapsed if elapsed > 0 else 0,
-                'upload_rate': self.total_uploaded / elapsed if elapsed > 0 else 0,
-                'num_peers': len(self.peers),
-                'unchoked_peers': sum(1 for p in self.peers.values()
-                                     if not p.is_choked_by_us),
-                'elapsed_time': elapsed
-            }
+        peers = self.snapshot
+        # A rechoke in progress samples the rates anyway; don't wait for it
+        if self.choke_lock.acquire(blocking=False):
+            try:
+                self._sample_rates(peers)
+            finally:
+                self.choke_lock.release()
+        elapsed = time.monotonic() - self.start_time
+        total_downloaded = sum(p.downloaded for p in peers)
+        total_uploaded = sum(p.uploaded for p in peers)
+
+        return {
+            'total_downloaded': total_downloaded,
+            'total_uploaded': total_uploaded,
+            'download_rate': total_downloaded / elapsed if elapsed > 0 else 0,
+            'upload_rate': total_uploaded / elapsed if elapsed > 0 else 0,
+            'num_peers': len(peers),
+            'unchoked_peers': sum(1 for p in peers if not p.is_choked_by_us),
+            'elapsed_time': elapsed
+        }
 
     def print_statistics(self):
         """Print peer statistics."""
@@ -229,16 +340,13 @@ class PeerManager:
         print(f"Peers: {stats['num_peers']} (unchoked: {stats['unchoked_peers']})")
         print(f"Elapsed: {stats['elapsed_time']:.1f} seconds")
 
-        with self.lock:
-            print("\nTop Peers:")
-            sorted_peers = sorted(self.peers.values(),
-                                key=lambda p: p.downloaded,
-                                reverse=True)
-            for i, peer in enumerate(sorted_peers[:5], 1):
-                status = "unchoked" if not peer.is_choked_by_us else "choked"
-                print(f"  {i}. {peer.ip}:{peer.port} - "
-                      f"{peer.downloaded:,} bytes, "
-                      f"{peer.download_rate / 1024:.2f} KB/s ({status})")
+        print("\nTop Peers:")
+        top_peers = heapq.nlargest(5, self.snapshot, key=_downloaded)
+        for i, peer in enumerate(top_peers, 1):
+            status = "unchoked" if not peer.is_choked_by_us else "choked"
+            print(f"  {i}. {peer.ip}:{peer.port} - "
+                  f"{peer.downloaded:,} bytes, "
+                  f"{peer.download_rate / 1024:.2f} KB/s ({status})")
 
 
 if __name__ == "__main__":
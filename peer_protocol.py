@@ -8,6 +8,16 @@
 # - Message types: choke, unchoke, interested, have, bitfield, request, piece, etc.
 
 import struct
+from itertools import compress
+
+# Precompiled formats for the per-message packing and unpacking
+_U32 = struct.Struct(">I")            # Length prefix
+_HEADER = struct.Struct(">IB")        # Length prefix + message ID
+_REQUEST = struct.Struct(">IBIII")    # Whole 17-byte request message
+_PIECE_HEADER = struct.Struct(">II")  # Piece index + begin offset
+
+# pstrlen (19) + pstr + 8 reserved bytes: the fixed first 28 bytes of a handshake
+_HANDSHAKE_PREFIX = bytes([19]) + b"BitTorrent protocol" + b"\x00" * 8
 
 
 def create_handshake(info_hash: bytes, peer_id: bytes) -> bytes:
@@ -21,10 +31,7 @@ def create_handshake(info_hash: bytes, peer_id: bytes) -> bytes:
     - 20 bytes: info_hash
     - 20 bytes: peer_id
     """
-    pstr = b"BitTorrent protocol"
-    pstrlen = bytes([len(pstr)])  # 19
-    reserved = b"\x00" * 8
-    return pstrlen + pstr + reserved + info_hash + peer_id
+    return _HANDSHAKE_PREFIX + info_hash + peer_id
 
 
 def parse_handshake(data: bytes) -> dict:
@@ -58,37 +65,68 @@ def create_message(message_id: int, payload: bytes = b"") -> bytes:
     - 1 byte: message ID
     - N bytes: payload
     """
-    length = 1 + len(payload)
-    return struct.pack(">I", length) + bytes([message_id]) + payload
+    return _HEADER.pack(1 + len(payload), message_id) + payload
 
 
-def parse_message(data: bytes) -> tuple:
+def parse_message(buf, offset: int = 0, end: int = None) -> tuple:
     """
-    Parse message from data.
+    Parse the message starting at buf[offset] (zero-copy).
 
-    Returns (message_id, payload, bytes_consumed)
+    Only buf[offset:end] is looked at (end defaults to len(buf)), so a
+    caller can parse straight out of a reusable receive buffer.
+
+    Returns (message_id, payload, bytes_consumed), where payload is a
+    memoryview into buf - copy it out before buf is modified
     Returns (None, None, 0) if not enough data yet
     Returns (None, b"", 4) for keep-alive message
     """
-    if len(data) < 4:
+    if end is None:
+        end = len(buf)
+    available = end - offset
+    if available < 4:
         return None, None, 0
 
-    length = struct.unpack(">I", data[:4])[0]
+    length = _U32.unpack_from(buf, offset)[0]
 
     if length == 0:
         # Keep-alive message
         return None, b"", 4
 
-    if len(data) < 4 + length:
+    if available < 4 + length:
         # Not enough data yet
         return None, None, 0
 
-    message_id = data[4]
-    payload = data[5:4+length]
+    message_id = buf[offset + 4]
+    payload = memoryview(buf)[offset + 5:offset + 4 + length]
 
     return message_id, payload, 4 + length
 
 
+def parse_piece_at(buf, offset: int = 0, end: int = None):
+    """
+    Fast path for the common case: a complete piece message at buf[offset].
+
+    Same buffer conventions as parse_message, but decodes the piece
+    header in the same step.
+
+    Returns (piece_index, begin, block, bytes_consumed), where block is a
+    memoryview into buf
+    Returns None if the next message is not a complete piece message -
+    fall back to parse_message for it
+    """
+    if end is None:
+        end = len(buf)
+    if end - offset < 13:
+        return None
+
+    length, message_id = _HEADER.unpack_from(buf, offset)
+    if message_id != MSG_PIECE or length < 9 or end - offset < 4 + length:
+        return None
+
+    index, begin = _PIECE_HEADER.unpack_from(buf, offset + 5)
+    return index, begin, memoryview(buf)[offset + 13:offset + 4 + length], 4 + length
+
+
 def create_request(piece_index: int, begin: int, length: int) -> bytes:
     """
     Create a 'request' message (ID=6).
@@ -100,8 +138,7 @@ def create_request(piece_index: int, begin: int, length: int) -> bytes:
     - begin: Byte offset within the piece
     - length: Number of bytes to request (usually 16KB)
     """
-    payload = struct.pack(">III", piece_index, begin, length)
-    return create_message(6, payload)
+    return _REQUEST.pack(13, 6, piece_index, begin, length)
 
 
 def parse_piece_message(payload: bytes) -> dict:
@@ -112,12 +149,18 @@ def parse_piece_message(payload: bytes) -> dict:
     - 4 bytes: piece index (big-endian int)
     - 4 bytes: begin offset (big-endian int)
     - N bytes: block data
+
+    The block is a memoryview into payload, not a copy.
     """
-    index, begin = struct.unpack(">II", payload[:8])
-    block = payload[8:]
+    index, begin = _PIECE_HEADER.unpack_from(payload)
+    block = memoryview(payload)[8:]
     return {'index': index, 'begin': begin, 'block': block}
 
 
+# Each byte value spread out to 8 bytes of 0/1, MSB first
+_BYTE_BITS = [bytes((byte >> (7 - bit)) & 1 for bit in range(8)) for byte in range(256)]
+
+
 def parse_bitfield(payload: bytes) -> list:
     """
     Parse bitfield message payload (ID=5).
@@ -125,13 +168,10 @@ def parse_bitfield(payload: bytes) -> list:
     Returns list of piece indices that peer has.
     Each byte represents 8 pieces (MSB first).
     """
-    pieces = []
-    for byte_index, byte in enumerate(payload):
-        for bit_index in range(8):
-            if byte & (1 << (7 - bit_index)):
-                piece_index = byte_index * 8 + bit_index
-                pieces.append(piece_index)
-    return pieces
+    # Expand to one flag byte per piece and let compress() pick out the
+    # indices, so the per-bit work stays in C
+    flags = b"".join(map(_BYTE_BITS.__getitem__, payload))
+    return list(compress(range(len(flags)), flags))
 
 
 # Message ID constants
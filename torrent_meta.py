@@ -1,5 +1,6 @@
+import hashlib
 from pathlib import Path
-from bencode import decode
+from bencode import BencodeDecoder, HAVE_C_DECODER, decode, encoded_length
 
 def load_torrent(path: str | Path) -> dict:
     """Load and decode a .torrent file."""
@@ -12,6 +13,55 @@ def load_torrent(path: str | Path) -> dict:
 
     return meta
 
+def load_torrent_with_info_hash(path: str | Path) -> tuple[dict, bytes]:
+    """Load a .torrent file and SHA-1 the raw bytes of its info dict.
+
+    Hashing the original bytes avoids re-encoding `info` (and its large
+    `pieces` blob) just to compute the info hash.
+    """
+    path = Path(path)
+    data = path.read_bytes()
+
+    meta = info_slice = None
+    if HAVE_C_DECODER:
+        # Decode in C, then work out where the info dict sits from the
+        # encoded sizes of the keys before it. Only trusted when the decoded
+        # torrent re-encodes to exactly the input size, i.e. nothing (such
+        # as a repeated key) was dropped or normalized along the way
+        meta = decode(data)
+        if not isinstance(meta, dict):
+            raise ValueError("Torrent file did not decode to a dictionary")
+        if encoded_length(meta) == len(data):
+            info_slice = _find_info_slice(meta, data)
+
+    if info_slice is None:
+        # The Python decoder records the exact offsets while parsing
+        decoder = BencodeDecoder(data)
+        meta = decoder.decode()
+        if not isinstance(meta, dict):
+            raise ValueError("Torrent file did not decode to a dictionary")
+        info_slice = decoder.info_slice
+        if info_slice is None:
+            raise ValueError("Torrent file has no info dictionary")
+
+    start, end = info_slice
+    # Hash through a view so the (multi-MB) info bytes aren't copied
+    return meta, hashlib.sha1(memoryview(data)[start:end]).digest()
+
+def _find_info_slice(meta: dict, data: bytes):
+    """(start, end) of the top-level info value in data, or None if unsure."""
+    offset = 1  # Past the top-level 'd'
+    for key, value in meta.items():
+        key_end = offset + encoded_length(key)
+        value_end = key_end + encoded_length(value)
+        if key == b'info':
+            if (data[offset:key_end] == b'4:info' and data[key_end:key_end + 1] == b'd'
+                    and data[value_end - 1:value_end] == b'e'):
+                return key_end, value_end
+            return None
+        offset = value_end
+    return None
+
 if __name__ == "__main__":
     import sys
 
@@ -1,15 +1,32 @@
 # tracker_http.py
 # Communicate with HTTP trackers to get peer lists
 
+import gzip
 import hashlib
-import random
+import http.client
+import os
+import struct
+import threading
 import urllib.parse
-import urllib.request
+from socket import inet_ntoa
 from bencode import decode, encode
 
+CONNECT_TIMEOUT = 5        # Seconds to open a tracker connection
+READ_TIMEOUT = 10          # Seconds to wait on a tracker response
+MAX_IDLE_PER_HOST = 4      # Keep-alive connections kept per tracker
+MAX_REDIRECTS = 3
+
+# Idle keep-alive connections, reused across announces to the same tracker
+_pool: dict[tuple, list] = {}  # (scheme, host:port) -> connections
+_pool_lock = threading.Lock()
+
 def calculate_info_hash(info_dict: dict) -> bytes: 
     """
     Calculate the SHA-1 hash of the bencoded info dictionary
+
+    Fallback for callers without the raw .torrent bytes; prefer
+    torrent_meta.load_torrent_with_info_hash, which hashes the original
+    encoding instead of re-encoding the dict.
     """
     bencoded = encode(info_dict)
     return hashlib.sha1(bencoded).digest()
@@ -17,31 +34,23 @@ def calculate_info_hash(info_dict: dict) -> bytes:
 def generate_peer_id() -> bytes:
     """Generate a random 20-byte peer id"""
     prefix = b"-PY0001-"
-    random_part = bytes([random.randint(0, 255) for _ in range(12)])
-    return prefix + random_part
-
-def url_encode_bytes(data: bytes) -> str:
-    """URL-encode bytes for use in query parameters
-
-    Some bytes in info_hash and peer_id need special encoding.
-    Example: a space becomes %20, a null byte becomes %00
-    """
-    return urllib.parse.quote(data, safe='')
+    return prefix + os.urandom(12)
 
 def build_tracker_url(announce_url: str, info_hash: bytes, peer_id: bytes,
                       total_length: int, port: int = 6881) -> str:
     params = {
-        'info_hash': url_encode_bytes(info_hash),
-        'peer_id': url_encode_bytes(peer_id),
-        'port': str(port),
-        'uploaded': '0',
-        'downloaded': '0',
-        'left': str(total_length),
-        'compact': '1',
+        'info_hash': info_hash,
+        'peer_id': peer_id,
+        'port': port,
+        'uploaded': 0,
+        'downloaded': 0,
+        'left': total_length,
+        'compact': 1,
         'event': 'started'
     }
 
-    query_string = '&'.join(f"{key}={value}" for key, value in params.items())
+    # Raw bytes are percent-encoded exactly once, in the same pass
+    query_string = urllib.parse.urlencode(params, quote_via=urllib.parse.quote, safe='')
 
     separator = '&' if '?' in announce_url else '?'
     return announce_url + separator + query_string
@@ -56,10 +65,71 @@ def request_peers(tracker_url: str) -> dict:
     Retrun the decoded response dictionary.
     """
 
-    with urllib.request.urlopen(tracker_url, timeout = 10) as response:
-        data = response.read()
+    for _ in range(MAX_REDIRECTS + 1):
+        status, headers, data = _http_get(tracker_url)
+        if status in (301, 302, 303, 307, 308) and headers.get('Location'):
+            tracker_url = urllib.parse.urljoin(tracker_url, headers['Location'])
+            continue
+        if status != 200:
+            raise http.client.HTTPException(f"Tracker returned HTTP {status}")
+        return decode(data)
+
+    raise http.client.HTTPException("Too many tracker redirects")
+
+def _http_get(url: str) -> tuple:
+    """
+    GET url over a pooled keep-alive connection, asking for gzip.
+
+    Returns (status, headers, body) with the body already decompressed.
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise ValueError(f"Unsupported tracker scheme: {parts.scheme}")
+    key = (parts.scheme, parts.netloc)
+    path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+    request_headers = {'Accept-Encoding': 'gzip'}
+
+    with _pool_lock:
+        idle = _pool.get(key)
+        conn = idle.pop() if idle else None
+
+    # A pooled connection may have been closed by the tracker meanwhile;
+    # in that case retry once on a fresh one
+    for reused in ((True, False) if conn else (False,)):
+        if not reused:
+            conn_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                          else http.client.HTTPConnection)
+            conn = conn_class(parts.netloc, timeout=CONNECT_TIMEOUT)
+            conn.connect()
+            conn.sock.settimeout(READ_TIMEOUT)
+        try:
+            conn.request('GET', path, headers=request_headers)
+            response = conn.getresponse()
+            data = response.read()
+            break
+        except (http.client.HTTPException, ConnectionError):
+            conn.close()
+            if not reused:
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+    if response.getheader('Content-Encoding', '').lower() == 'gzip':
+        data = gzip.decompress(data)
+
+    if response.will_close:
+        conn.close()
+    else:
+        with _pool_lock:
+            idle = _pool.setdefault(key, [])
+            if len(idle) < MAX_IDLE_PER_HOST:
+                idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
 
-    return decode(data)
+    return response.status, response.headers, data
 
 def parse_compact_peers(peer_data: bytes) -> list[dict]:
     """
@@ -76,28 +146,19 @@ def parse_compact_peers(peer_data: bytes) -> list[dict]:
     if len(peer_data) % 6 != 0:
         raise ValueError(f"Invalid compact peer data length: {len(peer_data)}")
 
-    peers = []
-    for i in range(0, len(peer_data), 6): 
-        chunk = peer_data[i:i+6]
-
-        ip = f"{chunk[0]}.{chunk[1]}.{chunk[2]}.{chunk[3]}"
-
-        # Last 2 bytes are port (big-endian)
-        port = (chunk[4] << 8) | chunk[5]
-
-        peers.append({'ip': ip, 'port': port})
-
-    return peers
+    # One C-level pass over the 6-byte records; inet_ntoa formats the IP
+    return [{'ip': inet_ntoa(ip), 'port': port}
+            for ip, port in struct.iter_unpack(">4sH", peer_data)]
 
 
 # Example usage
 if __name__ == "__main__":
-    from torrent_meta import load_torrent
+    from torrent_meta import load_torrent_with_info_hash
 
     print("=== BitTorrent Tracker Test ===\n")
 
     # Load torrent file
-    meta = load_torrent("ubuntu-24.04.3-live-server-amd64.iso.torrent")
+    meta, info_hash = load_torrent_with_info_hash("ubuntu-24.04.3-live-server-amd64.iso.torrent")
 
     # Extract info
     announce = meta[b'announce'].decode('utf-8')
@@ -105,8 +166,6 @@ if __name__ == "__main__":
 
     print(f"Tracker: {announce}")
 
-    # Calculate info hash
-    info_hash = calculate_info_hash(info)
     print(f"Info hash: {info_hash.hex()}")
 
     # Get total file size